@@ -44,3 +44,21 @@ get_xnat_url() {
 
  echo "$url"
 }
+
+# Returns the cache options for the python commands.
+# When XNAT_CLI_CACHE names a directory, listings (projects, project users,
+# user groups) are cached there and reused by the following pipeline steps.
+# Set XNAT_CLI_REFRESH=1 to revalidate every cached listing with the server.
+
+get_cache_options() {
+ options=""
+
+ if [ -n "$XNAT_CLI_CACHE" ] ; then
+  options="--cache-dir $XNAT_CLI_CACHE"
+  if [ -n "$XNAT_CLI_REFRESH" ] ; then
+   options="$options --refresh"
+  fi
+ fi
+
+ echo "$options"
+}
@@ -30,7 +30,7 @@ set -e
 url=$(get_xnat_url ${system})
 set +e
 
-BOILER_PLATE=" -a $auth_string -x $url -e False "
+BOILER_PLATE=" -a $auth_string -x $url -e False $(get_cache_options) "
 
 list_projects_brief "$BASE_FOLDER" "$BOILER_PLATE" /tmp/projects_brief.txt
 sort /tmp/projects_brief.txt | uniq > /tmp/all_projects_sorted.txt
@@ -43,7 +43,7 @@ set -e
 url=$(get_xnat_url ${system})
 set +e
 
-BOILER_PLATE=" -a $auth_string -x $url -e False "
+BOILER_PLATE=" -a $auth_string -x $url -e False $(get_cache_options) "
 
 pre_flight
 list_projects_groups "$BASE_FOLDER" "$BOILER_PLATE --csv test_data/active_projects.txt" test_data/active_project_groups.txt
@@ -35,7 +35,7 @@ list_groups() {
  url=$( get_xnat_url ${system} )
  set +e
 
- BOILER_PLATE=" -a $auth_string -x $url -e False "
+ BOILER_PLATE=" -a $auth_string -x $url -e False $(get_cache_options) "
 
  list_groups "$BASE_FOLDER" "$BOILER_PLATE" "$target_user"
  
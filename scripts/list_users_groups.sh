@@ -0,0 +1,38 @@
+#!/bin/bash
+
+# Arguments:
+#              Base Folder
+#              Boiler Plate
+#              User list file (one login per line)
+
+list_groups() {
+ export PYTHONPATH="$1/../src"
+
+ echo python3 -m xnat_cli_scripts.users $2 -L --groups -c $3
+      python3 -m xnat_cli_scripts.users $2 -L --groups -c $3
+}
+
+# Main starts here
+# Arguments:
+#            authentication string (user or user:password)
+#            user list file (one login per line, '-' for stdin)
+#            system (found in common.sh)
+
+ if [ $# -ne 3 ] ; then
+  echo "Arguments: auth_string user_list_file system"
+  exit 1
+ fi
+
+ auth_string="$1"
+ user_list="$2"
+ system="$3"
+
+ BASE_FOLDER=`dirname $0`
+ source $BASE_FOLDER/common.sh
+ set -e
+ url=$( get_xnat_url ${system} )
+ set +e
+
+ BOILER_PLATE=" -a $auth_string -x $url -e False -w 8 $(get_cache_options) "
+
+ list_groups "$BASE_FOLDER" "$BOILER_PLATE" "$user_list"
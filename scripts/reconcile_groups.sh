@@ -0,0 +1,42 @@
+#!/bin/bash
+
+# Arguments:
+#              Base Folder
+#              Boiler Plate
+#              Desired groups file
+#              Output file
+reconcile_projects_groups() {
+ export PYTHONPATH="$1/../src"
+
+ echo python3 -m xnat_cli_scripts.projects $2 --reconcile $3
+      python3 -m xnat_cli_scripts.projects $2 --reconcile $3 > "$4"
+}
+
+# Main starts here
+# Every project named in the desired groups file is reconciled completely; only the
+# authenticated user's own Owners memberships are kept when the file leaves them out.
+# Arguments:
+#            authentication string (user or user:password)
+#            desired groups file: {project}{tab}{user}{tab}{group}, one row per membership
+#            system (found in common.sh)
+#            optional: --dry-run to only write the planned changes
+
+ if [ $# -lt 3 ] ; then
+  echo "Arguments: auth_string desired_groups_file system [--dry-run]"
+  exit 1
+ fi
+
+ auth_string="$1"
+ desired_file="$2"
+ system="$3"
+ dry_run="$4"
+
+ BASE_FOLDER=`dirname $0`
+ source $BASE_FOLDER/common.sh
+ set -e
+ url=$( get_xnat_url ${system} )
+ set +e
+
+ BOILER_PLATE=" -a $auth_string -x $url -e False -w 8 $dry_run "
+
+ reconcile_projects_groups "$BASE_FOLDER" "$BOILER_PLATE" "$desired_file" test_data/project_groups_reconcile.txt
@@ -0,0 +1,56 @@
+#!/bin/bash
+
+# Arguments:
+#              Base Folder
+#              Boiler Plate
+#              Snapshot file
+refresh_snapshot() {
+ export PYTHONPATH="$1/../src"
+
+ echo python3 -m xnat_cli_scripts.snapshot create $2 -o $3
+      python3 -m xnat_cli_scripts.snapshot create $2 -o $3
+}
+
+# Arguments:
+#              Base Folder
+#              Snapshot file
+#              Query name
+#              Extra options
+query_snapshot() {
+ export PYTHONPATH="$1/../src"
+
+ echo python3 -m xnat_cli_scripts.snapshot query $2 $3 $4
+      python3 -m xnat_cli_scripts.snapshot query $2 $3 $4
+}
+
+# Main starts here
+# Crawls (or incrementally refreshes) the snapshot once, then answers the audit
+# questions from it without further requests to the server.
+# Arguments:
+#            authentication string (user or user:password)
+#            snapshot file
+#            system (found in common.sh)
+
+ if [ $# -ne 3 ] ; then
+  echo "Arguments: auth_string snapshot_file system"
+  exit 1
+ fi
+
+ auth_string="$1"
+ snapshot_file="$2"
+ system="$3"
+
+ BASE_FOLDER=`dirname $0`
+ source $BASE_FOLDER/common.sh
+ set -e
+ url=$( get_xnat_url ${system} )
+ set +e
+
+ BOILER_PLATE=" -a $auth_string -x $url -e False -w 8 "
+
+ refresh_snapshot "$BASE_FOLDER" "$BOILER_PLATE" "$snapshot_file"
+ query_snapshot   "$BASE_FOLDER" "$snapshot_file" single-user-groups
+ query_snapshot   "$BASE_FOLDER" "$snapshot_file" owners-without-members
+ if [ -f test_data/inactive_projects.txt ] ; then
+  query_snapshot  "$BASE_FOLDER" "$snapshot_file" inactive-project-users "--inactive test_data/inactive_projects.txt"
+ fi
@@ -2,7 +2,12 @@
 
 
 import argparse
-from typing import Union
+import collections
+import concurrent.futures
+import csv
+import json
+import sys
+from typing import Any, Callable, Iterable, Iterator, Sequence, TextIO, Tuple, Union
 
 # Common functions for CLI executables
 
@@ -26,8 +31,150 @@ def extract_auth_password(args: argparse.Namespace) -> Union[str,None]:
 
     return auth_password
 
-def extract_extension_types(args: argparse.Namespace) -> bool:
-    if (args.extension_types is not None and args.extension_types == "True"):
-        return True
+def extract_workers(args: argparse.Namespace) -> int:
+    if (getattr(args, "workers", None) is None):
+        return 1
 
-    return False
+    return max(1, int(args.workers))
+
+def add_session_arguments(parser: argparse.ArgumentParser, cache: bool = True) -> None:
+    """
+    Adds the connection options read by cli_session.connect and its hooks: workers, rate
+    limiting, the listing cache (unless cache is False), statistics, login and timeout.
+    Defined here rather than next to the cli_session readers so --help does not import requests.
+    """
+    parser.add_argument('-w', '--workers',         dest='workers',         help="Number of concurrent REST requests (default 1)", type=int)
+    parser.add_argument(      '--rate',            dest='rate',            help="Maximum REST requests per second across all workers", type=float)
+    parser.add_argument(      '--burst',           dest='burst',           help="Requests allowed back to back before --rate applies", type=int)
+    if cache:
+        parser.add_argument(  '--cache-dir',       dest='cache_dir',       help="Directory for the on-disk cache of listing responses (disabled when omitted)")
+        parser.add_argument(  '--cache-size',      dest='cache_size',      help="Maximum size of the cache directory in MB (default 256)", type=float)
+        parser.add_argument(  '--cache-ttl',       dest='cache_ttl',       help="Seconds a cached listing is used without revalidation (default per endpoint)", type=int)
+        parser.add_argument(  '--refresh',         dest='refresh',         help="Revalidate every cached listing with the server", action='store_true')
+    parser.add_argument(      '--stats',           dest='stats',           help="Print per-endpoint request statistics to stderr at exit", action='store_true')
+    parser.add_argument(      '--trace',           dest='trace_file',      help="Write one JSON line per REST request to this file")
+    parser.add_argument(      '--fresh-login',     dest='fresh_login',     help="Log in again instead of reusing the cached JSESSION", action='store_true')
+    parser.add_argument(      '--timeout',         dest='timeout',         help="Seconds to wait for the server before a request fails (default 300)", type=float)
+
+def format_error(error: Exception) -> str:
+    """ Collapses an exception into a single line suitable for a tab separated row """
+    message = " ".join(str(error).split())
+    if message == "":
+        message = type(error).__name__
+
+    return message
+
+def ordered_map(function: Callable[[Any], Any], items: Iterable[Any], workers: int,
+                processes: bool = False, initializer: Union[Callable, None] = None, initargs: tuple = ()) -> Iterator[Tuple[Any, Any, Union[Exception, None]]]:
+    """
+    Applies function to every item using a bounded pool of worker threads
+    (or worker processes when processes is True; function must then be picklable).
+    Yields (item, result, error) tuples in the same order as the input items;
+    an exception raised for one item is returned in error and does not stop the others.
+    Only a small window of items is in flight at any time, so results stream out
+    as soon as the head of the window completes.
+    """
+    if workers <= 1:
+        if initializer is not None:
+            initializer(*initargs)
+        for item in items:
+            try:
+                yield item, function(item), None
+            except Exception as e:
+                yield item, None, e
+        return
+
+    if processes:
+        executor = concurrent.futures.ProcessPoolExecutor(max_workers=workers, initializer=initializer, initargs=initargs)
+    else:
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers, initializer=initializer, initargs=initargs)
+
+    window = collections.deque()
+    with executor:
+        for item in items:
+            window.append((item, executor.submit(function, item)))
+            if len(window) >= workers * 2:
+                yield _complete_future(*window.popleft())
+
+        while window:
+            yield _complete_future(*window.popleft())
+
+def _complete_future(item: Any, future: concurrent.futures.Future) -> Tuple[Any, Any, Union[Exception, None]]:
+    try:
+        return item, future.result(), None
+    except Exception as e:
+        return item, None, e
+
+# Buffered row output shared by the list commands
+
+ROW_FORMATS = ["tsv", "csv", "jsonl"]
+WRITE_BUFFER_SIZE = 1024 * 1024
+TSV_ESCAPES = str.maketrans({"\\": "\\\\", "\t": "\\t", "\n": "\\n", "\r": "\\r"})
+
+class RowWriter:
+    """
+    Streams rows as TSV (tabs, newlines and backslashes escaped), CSV (quoted as needed)
+    or JSON Lines (one object per row keyed by columns) through a large write buffer.
+    Free-form title lines are only written in TSV, where they always have been.
+    """
+    def __init__(self, stream: TextIO, row_format: str = "tsv", columns: Sequence[str] = (), close_stream: bool = False):
+        self.stream = stream
+        self.row_format = row_format
+        self.columns = list(columns)
+        self.close_stream = close_stream
+        self.csv_writer = csv.writer(stream, lineterminator="\n") if row_format == "csv" else None
+
+    def title(self, text: str) -> None:
+        if self.row_format == "tsv":
+            self.stream.write(text + "\n")
+
+    def header(self) -> None:
+        if self.row_format != "jsonl":
+            self.row(*self.columns)
+
+    def row(self, *values: Any) -> None:
+        if self.row_format == "tsv":
+            self.stream.write("\t".join(str(v).translate(TSV_ESCAPES) for v in values) + "\n")
+        elif self.row_format == "csv":
+            self.csv_writer.writerow(values)
+        else:
+            self.stream.write(json.dumps(dict(zip(self.columns, values)), ensure_ascii=False, default=str) + "\n")
+
+    def error(self, keys: Sequence[Any], message: str, status: str = "ERROR") -> None:
+        """ Writes a per-row failure: the identifying key values followed by status and message """
+        if self.row_format == "jsonl":
+            record = dict(zip(self.columns, keys))
+            record["Status"] = status
+            record["Message"] = message
+            self.stream.write(json.dumps(record, ensure_ascii=False, default=str) + "\n")
+        else:
+            self.row(*keys, status, message)
+
+    def close(self) -> None:
+        if self.close_stream:
+            self.stream.close()
+        else:
+            self.stream.flush()
+
+    def __enter__(self) -> "RowWriter":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+def add_output_arguments(parser: argparse.ArgumentParser) -> None:
+    """ Adds --format and --output, read by open_row_writer """
+    parser.add_argument(      '--format',          dest='output_format',   help="Row format: tsv (default), csv or jsonl", choices=ROW_FORMATS)
+    parser.add_argument(      '--output',          dest='output_file',     help="Write rows to this file instead of stdout")
+
+def open_row_writer(args: argparse.Namespace, columns: Sequence[str] = ()) -> RowWriter:
+    """ Opens a RowWriter on --output (stdout when omitted or '-') in the --format requested """
+    row_format = getattr(args, "output_format", None) or "tsv"
+    output_file = getattr(args, "output_file", None)
+
+    if output_file is None or output_file == "-":
+        sys.stdout.flush()
+        stream = open(sys.stdout.fileno(), "w", buffering=WRITE_BUFFER_SIZE, encoding="utf-8", newline="", closefd=False)
+    else:
+        stream = open(output_file, "w", buffering=WRITE_BUFFER_SIZE, encoding="utf-8", newline="")
+    return RowWriter(stream, row_format, columns, close_stream=True)
@@ -0,0 +1,925 @@
+#!/bin/python3
+"""
+HTTP layer shared by the CLI commands that talk to XNAT: rate limiting and
+throttling retries, the on-disk listing cache and request statistics, all
+installed on the requests session of a connection by install_session_hooks,
+and RestSession, a JSESSION-authenticated session for the commands that only
+call raw REST paths.
+Kept apart from cli_common so that argument parsing and --help never pay for
+importing requests: the commands import this module (and requests) inside
+main() and the functions that run after the arguments are parsed, and only
+under TYPE_CHECKING at module level.
+"""
+
+import argparse
+import atexit
+import collections
+import email.utils
+import functools
+import hashlib
+import json
+import os
+import random
+import re
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+from typing import Any, BinaryIO, Callable, Iterable, Iterator, Sequence, TextIO, Tuple, Union
+
+import requests
+import requests.adapters
+import requests.structures
+import requests.utils
+
+import xnat_cli_scripts.cli_common
+
+# Rate limiting shared by every REST call of a command
+
+THROTTLE_STATUS_CODES = (429, 503)
+
+class RateLimiter:
+    """
+    Token bucket shared by all worker threads of a command.
+    rate is the sustained requests-per-second budget (None means unlimited) and
+    burst the number of requests that may be issued back to back.
+    When the server throttles, the current rate is halved and every worker is
+    held back until the pause expires; successful calls grow it back towards rate.
+    """
+    def __init__(self, rate: Union[float, None], burst: int = 1):
+        self.max_rate = rate
+        self.rate = rate
+        self.burst = max(1, burst)
+        self.tokens = float(self.burst)
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self.lock = threading.Lock()
+
+    def acquire(self) -> None:
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                wait = self.paused_until - now
+                if wait <= 0:
+                    if self.rate is None:
+                        return
+                    self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                    self.updated = now
+                    if self.tokens >= 1.0:
+                        self.tokens -= 1.0
+                        return
+                    wait = (1.0 - self.tokens) / self.rate
+            time.sleep(wait)
+
+    def throttled(self, delay: float) -> None:
+        with self.lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + delay)
+            if self.rate is not None:
+                self.rate = max(self.max_rate / 16, self.rate / 2)
+
+    def succeeded(self) -> None:
+        if self.rate is None or self.rate >= self.max_rate:
+            return
+        with self.lock:
+            self.rate = min(self.max_rate, self.rate + self.max_rate / 20)
+
+class ThrottledAdapter(requests.adapters.HTTPAdapter):
+    """
+    HTTPAdapter that takes a token from the RateLimiter before every request and
+    retries 429/503 responses, waiting for Retry-After when the server sends it
+    and for an exponential backoff with jitter otherwise.
+    GET requests are answered from the optional MetadataCache when possible and
+    every request is reported to the optional RequestStats.
+    """
+    def __init__(self, limiter: RateLimiter, cache: Union["MetadataCache", None] = None,
+                 stats: Union["RequestStats", None] = None,
+                 max_retries_throttled: int = 6, backoff: float = 1.0, **kwargs):
+        super().__init__(**kwargs)
+        self.limiter = limiter
+        self.cache = cache
+        self.stats = stats
+        self.max_retries_throttled = max_retries_throttled
+        self.backoff = backoff
+        self.local = threading.local()
+
+    def send(self, request: requests.PreparedRequest, **kwargs) -> requests.Response:
+        # Per request: limiter wait, throttled attempts with their backoff, and when the
+        # request that got the final answer was sent (None when served from the cache)
+        self.local.wait = 0.0
+        self.local.retries = 0
+        self.local.retry_time = 0.0
+        self.local.sent = None
+        self.local.cached = False
+        if self.stats is None:
+            return self.send_cached(request, **kwargs)
+
+        start = time.perf_counter()
+        try:
+            response = self.send_cached(request, **kwargs)
+        except Exception as e:
+            self.stats.record(request, None, time.perf_counter() - (self.local.sent or start), self.local.wait,
+                              self.local.retries, self.local.retry_time, False, error=e)
+            raise
+        if not kwargs.get("stream"):
+            # requests reads the body right after send() unless streaming; reading it here
+            # puts the transfer time into the latency
+            response.content
+        self.stats.record(request, response, time.perf_counter() - (self.local.sent or start), self.local.wait,
+                          self.local.retries, self.local.retry_time, self.local.cached)
+        return response
+
+    def send_cached(self, request: requests.PreparedRequest, **kwargs) -> requests.Response:
+        if self.cache is None:
+            return self.send_throttled(request, **kwargs)
+
+        if request.method != "GET":
+            response = self.send_throttled(request, **kwargs)
+            if response.status_code < 400:
+                self.cache.invalidate(request.url)
+            return response
+
+        ttl = self.cache.ttl_for(request.url)
+        if ttl is None:
+            return self.send_throttled(request, **kwargs)
+
+        entry = self.cache.lookup(request.url)
+        if entry is not None:
+            meta, body = entry
+            if self.cache.is_fresh(meta, ttl):
+                self.local.cached = True
+                return self.cached_response(request, meta, body)
+            if meta.get("etag"):
+                request.headers["If-None-Match"] = meta["etag"]
+            if meta.get("last_modified"):
+                request.headers["If-Modified-Since"] = meta["last_modified"]
+
+        try:
+            response = self.send_throttled(request, **kwargs)
+        except Exception:
+            if entry is not None:
+                body.close()
+            raise
+        if entry is not None and response.status_code == 304:
+            response.close()
+            self.cache.revalidated(request.url, meta, body)
+            self.local.cached = True
+            return self.cached_response(request, meta, body)
+        if entry is not None:
+            body.close()
+        if response.status_code == 200:
+            if kwargs.get("stream"):
+                # Streamed listings are cached as they are read, never loaded whole here
+                self.cache.store_streaming(request.url, response)
+            else:
+                self.cache.store(request.url, response)
+        return response
+
+    def send_throttled(self, request: requests.PreparedRequest, **kwargs) -> requests.Response:
+        attempt = 0
+        while True:
+            waiting = time.perf_counter()
+            self.limiter.acquire()
+            self.local.sent = time.perf_counter()
+            if attempt == 0:
+                self.local.wait = self.local.sent - waiting
+            else:
+                # The backoff delay is spent in acquire() until the limiter's pause expires
+                self.local.retry_time += self.local.sent - waiting
+            response = super().send(request, **kwargs)
+            if response.status_code not in THROTTLE_STATUS_CODES or attempt >= self.max_retries_throttled:
+                self.limiter.succeeded()
+                return response
+
+            delay = retry_after_seconds(response)
+            if delay is None:
+                delay = self.backoff * (2 ** attempt) * (0.5 + random.random())
+            response.close()
+            self.limiter.throttled(delay)
+            self.local.retry_time += time.perf_counter() - self.local.sent
+            attempt += 1
+            self.local.retries = attempt
+
+    def cached_response(self, request: requests.PreparedRequest, meta: dict, body: BinaryIO) -> requests.Response:
+        """ A 200 response whose body is read from the open cache entry, like a streamed download """
+        response = requests.Response()
+        response.status_code = 200
+        response.reason = "OK"
+        response.headers = requests.structures.CaseInsensitiveDict(meta.get("headers", {}))
+        response.raw = body
+        response.encoding = meta.get("encoding")
+        response.url = request.url
+        response.request = request
+        response.connection = self
+        return response
+
+def retry_after_seconds(response: requests.Response) -> Union[float, None]:
+    """ Parses a Retry-After header given either in seconds or as an HTTP date """
+    value = response.headers.get("Retry-After")
+    if value is None:
+        return None
+
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+
+    try:
+        retry_time = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, retry_time.timestamp() - time.time())
+
+def extract_rate_limiter(args: argparse.Namespace) -> RateLimiter:
+    """
+    Builds the RateLimiter from --rate and --burst. The older --sleep option is
+    honoured as a rate of one request per SLEEP seconds when --rate is not given.
+    """
+    rate = getattr(args, "rate", None)
+    if rate is None and getattr(args, "sleep", None):
+        try:
+            sleep_time = float(args.sleep)
+            if sleep_time > 0:
+                rate = 1.0 / sleep_time
+        except ValueError:
+            print("[ERROR] Invalid sleep value. Please provide a valid number.")
+
+    if rate is not None and rate <= 0:
+        rate = None
+
+    burst = getattr(args, "burst", None) or 1
+    return RateLimiter(rate, burst)
+
+def install_session_hooks(connection, args: argparse.Namespace) -> ThrottledAdapter:
+    """
+    Routes every request issued through the connection via a shared RateLimiter,
+    the on-disk MetadataCache when --cache-dir is given and RequestStats when
+    --stats or --trace is given
+    """
+    limiter = extract_rate_limiter(args)
+    cache = extract_metadata_cache(args)
+    stats = extract_request_stats(args)
+    pool_size = max(10, xnat_cli_scripts.cli_common.extract_workers(args))
+    adapter = ThrottledAdapter(limiter, cache, stats, pool_connections=pool_size, pool_maxsize=pool_size)
+    connection.interface.mount("https://", adapter)
+    connection.interface.mount("http://", adapter)
+    return adapter
+
+
+# Request instrumentation: per-endpoint summary (--stats) and per-request trace (--trace)
+
+# Path segments that name a collection; the segment after one is an identifier
+ENDPOINT_COLLECTIONS = {
+    "projects":       "{project}",
+    "subjects":       "{subject}",
+    "experiments":    "{experiment}",
+    "scans":          "{scan}",
+    "assessors":      "{assessor}",
+    "resources":      "{resource}",
+    "files":          "{file}",
+    "users":          "{user}",
+    "groups":         "{group}",
+    "accessibility":  "{accessibility}",
+    "schemas":        "{schema}",
+}
+
+def endpoint_template(url: str) -> str:
+    """
+    Replaces identifiers in a URL path by placeholders so calls can be grouped:
+    /data/projects/P1/users -> /data/projects/{project}/users. Project memberships
+    are addressed as users/{group}/{user}; the query string is dropped.
+    """
+    segments = urllib.parse.urlsplit(url).path.rstrip("/").split("/")
+    template = []
+    index = 0
+    while index < len(segments):
+        segment = segments[index]
+        template.append(segment)
+        placeholder = ENDPOINT_COLLECTIONS.get(segment)
+        if placeholder is not None and index + 1 < len(segments):
+            if segment == "users" and template[-2:-1] == ["{project}"]:
+                template.extend(["{group}", "{user}"][:len(segments) - index - 1])
+                index += 2
+            else:
+                template.append(placeholder)
+                index += 1
+        index += 1
+    return "/".join(template) or "/"
+
+def percentile(sorted_values: Sequence[float], fraction: float) -> float:
+    """ Nearest-rank percentile of an already sorted list """
+    if not sorted_values:
+        return 0.0
+    rank = max(1, int(-(-fraction * len(sorted_values) // 1)))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+class RequestStats:
+    """
+    Collects, per "METHOD endpoint template": call count, latencies, bytes sent and
+    received, time waiting for the RateLimiter, throttling retries and the time they
+    took, cache hits and error status codes. A latency covers only the attempt that got
+    the final answer, from sending it to the end of a non-streamed body.
+    With a trace stream every request is also written as one JSON line.
+    """
+    def __init__(self, trace: Union[TextIO, None] = None):
+        self.trace = trace
+        self.lock = threading.Lock()
+        self.started = time.perf_counter()
+        self.endpoints = collections.OrderedDict()
+
+    def record(self, request: requests.PreparedRequest, response: Union[requests.Response, None], elapsed: float,
+               wait: float, retries: int, retry_time: float, cached: bool, error: Union[Exception, None] = None) -> None:
+        endpoint = f"{request.method} {endpoint_template(request.url)}"
+        body = request.body or b""
+        bytes_out = len(body.encode("utf-8") if isinstance(body, str) else body) if not hasattr(body, "read") else 0
+        if response is not None:
+            status = response.status_code
+            if response._content_consumed and isinstance(response._content, bytes):
+                bytes_in = len(response._content)
+            else:
+                bytes_in = int(response.headers.get("Content-Length") or 0)
+        else:
+            status = type(error).__name__
+            bytes_in = 0
+
+        with self.lock:
+            entry = self.endpoints.get(endpoint)
+            if entry is None:
+                entry = self.endpoints[endpoint] = {"latencies": [], "bytes_in": 0, "bytes_out": 0, "wait": 0.0,
+                                                    "retries": 0, "retry_time": 0.0, "cached": 0, "errors": collections.Counter()}
+            entry["latencies"].append(elapsed)
+            entry["bytes_in"] += bytes_in
+            entry["bytes_out"] += bytes_out
+            entry["wait"] += wait
+            entry["retries"] += retries
+            entry["retry_time"] += retry_time
+            entry["cached"] += cached
+            if response is None or status >= 400:
+                entry["errors"][str(status)] += 1
+
+            if self.trace is not None:
+                self.trace.write(json.dumps({
+                    "time":       round(time.time(), 6),
+                    "method":     request.method,
+                    "url":        request.url,
+                    "endpoint":   endpoint_template(request.url),
+                    "status":     status,
+                    "elapsed_ms": round(elapsed * 1000, 3),
+                    "bytes_in":   bytes_in,
+                    "bytes_out":  bytes_out,
+                    "wait_ms":    round(wait * 1000, 3),
+                    "retries":    retries,
+                    "retry_ms":   round(retry_time * 1000, 3),
+                    "cached":     cached,
+                    "thread":     threading.current_thread().name,
+                }) + "\n")
+
+    def summary(self, stream: TextIO) -> None:
+        """ Writes one line per endpoint (latencies in ms, limiter wait and retry time in s) and a total line """
+        columns = ["Endpoint", "Calls", "p50", "p95", "p99", "Max", "Bytes In", "Bytes Out", "Wait", "Retries", "Retry Time", "Cached", "Errors"]
+        lines = [columns]
+        totals = {"calls": 0, "bytes_in": 0, "bytes_out": 0, "wait": 0.0, "retries": 0, "retry_time": 0.0, "cached": 0, "errors": 0}
+        with self.lock:
+            for endpoint, entry in sorted(self.endpoints.items(), key=lambda item: -sum(item[1]["latencies"])):
+                latencies = sorted(entry["latencies"])
+                errors = " ".join(f"{code}x{count}" for code, count in sorted(entry["errors"].items()))
+                lines.append([endpoint, len(latencies)]
+                             + [f"{percentile(latencies, f) * 1000:.1f}" for f in (0.50, 0.95, 0.99, 1.0)]
+                             + [entry["bytes_in"], entry["bytes_out"], f"{entry['wait']:.2f}", entry["retries"],
+                                f"{entry['retry_time']:.2f}", entry["cached"], errors or "-"])
+                totals["calls"] += len(latencies)
+                for key in ("bytes_in", "bytes_out", "wait", "retries", "retry_time", "cached"):
+                    totals[key] += entry[key]
+                totals["errors"] += sum(entry["errors"].values())
+
+        stream.write("\nRequest Statistics\n")
+        for line in lines:
+            stream.write("\t".join(str(v) for v in line) + "\n")
+        stream.write(f"Total: {totals['calls']} requests, {totals['bytes_in']} bytes in, {totals['bytes_out']} bytes out, "
+                     f"{totals['wait']:.2f}s limiter wait, {totals['retries']} retries ({totals['retry_time']:.2f}s), "
+                     f"{totals['cached']} cached, {totals['errors']} errors "
+                     f"in {time.perf_counter() - self.started:.2f}s\n")
+        stream.flush()
+
+    def close(self, print_summary: bool = False) -> None:
+        if print_summary:
+            self.summary(sys.stderr)
+        with self.lock:
+            if self.trace is not None:
+                self.trace.close()
+                self.trace = None
+
+def extract_request_stats(args: argparse.Namespace) -> Union[RequestStats, None]:
+    """
+    Builds RequestStats when --stats or --trace FILE is given; the summary is
+    printed to stderr and the trace file closed when the command exits
+    """
+    print_summary = getattr(args, "stats", False)
+    trace_file = getattr(args, "trace_file", None)
+    if not print_summary and trace_file is None:
+        return None
+
+    trace = open(trace_file, "w", buffering=xnat_cli_scripts.cli_common.WRITE_BUFFER_SIZE, encoding="utf-8") if trace_file is not None else None
+    stats = RequestStats(trace)
+    atexit.register(stats.close, print_summary)
+    return stats
+
+
+# On-disk cache of listing responses shared by chained invocations
+
+# Seconds a cached response is served without asking the server; matched against the URL path
+CACHE_TTLS = [
+    (re.compile(r"/data/projects/?$"),                      900),
+    (re.compile(r"/data/projects/[^/]+/users/?$"),          900),
+    (re.compile(r"/data/projects/[^/]+/accessibility/?$"),  900),
+    (re.compile(r"/data/subjects/?$"),                      300),
+    (re.compile(r"/data/experiments/?$"),                   300),
+    (re.compile(r"/data/projects/[^/]+/experiments/?$"),    300),
+    (re.compile(r"/xapi/users/[^/]+/groups/?$"),            900),
+]
+
+# Writes whose effect shows in listings other than their parents': written path -> listings dropped
+CACHE_INVALIDATIONS = [
+    (re.compile(r"/data/(projects/[^/]+/)?(subjects|experiments)(/|$)"),
+     re.compile(r"/data/(projects/[^/]+/)?(subjects|experiments)/?$")),
+    (re.compile(r"/data/projects/[^/]+/users/|/xapi/users/[^/]+/groups(/|$)"),
+     re.compile(r"/data/projects/[^/]+/users/?$|/xapi/users/[^/]+/groups/?$")),
+]
+
+# Bytes per read when an entry is copied
+CACHE_COPY_SIZE = 256 * 1024
+
+class MetadataCache:
+    """
+    Stores GET responses of the listing endpoints in CACHE_TTLS under directory.
+    Each entry is one file: a JSON metadata line followed by the response body.
+    Entries younger than their TTL are served directly; older ones are revalidated
+    with If-None-Match/If-Modified-Since when the server sent an ETag/Last-Modified.
+    Total size is capped at max_bytes by evicting the least recently used entries,
+    and any successful PUT/POST/DELETE drops cached listings of its parent paths and
+    those CACHE_INVALIDATIONS relates to it.
+    """
+    def __init__(self, directory: str, namespace: str, max_bytes: int, refresh: bool = False, ttl: Union[int, None] = None):
+        self.directory = directory
+        self.namespace = namespace
+        self.max_bytes = max_bytes
+        self.refresh = refresh
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+        # key -> [size, last access, URL path]
+        self.index = {}
+        self.total_bytes = 0
+        for entry in os.scandir(directory):
+            if not entry.name.endswith(".entry"):
+                continue
+            try:
+                with open(entry.path, "rb") as infile:
+                    meta = json.loads(infile.readline())
+                stat = entry.stat()
+            except (OSError, ValueError):
+                continue
+            self.index[entry.name[:-len(".entry")]] = [stat.st_size, stat.st_mtime, urllib.parse.urlsplit(meta["url"]).path]
+            self.total_bytes += stat.st_size
+
+    def ttl_for(self, url: str) -> Union[int, None]:
+        path = urllib.parse.urlsplit(url).path
+        for pattern, ttl in CACHE_TTLS:
+            if pattern.search(path):
+                return ttl if self.ttl is None else self.ttl
+        return None
+
+    def is_fresh(self, meta: dict, ttl: int) -> bool:
+        return not self.refresh and time.time() - meta["stored"] < ttl
+
+    def key_for(self, url: str) -> str:
+        return hashlib.sha256(f"{self.namespace}\n{url}".encode("utf-8")).hexdigest()
+
+    def entry_path(self, key: str) -> str:
+        return os.path.join(self.directory, key + ".entry")
+
+    def lookup(self, url: str) -> Union[Tuple[dict, BinaryIO], None]:
+        """ Returns the entry's metadata and its file, open and positioned at the start of the body """
+        key = self.key_for(url)
+        try:
+            infile = open(self.entry_path(key), "rb")
+        except OSError:
+            return None
+        try:
+            meta = json.loads(infile.readline())
+            os.utime(self.entry_path(key))
+        except (OSError, ValueError):
+            infile.close()
+            return None
+
+        with self.lock:
+            if key in self.index:
+                self.index[key][1] = time.time()
+        return meta, infile
+
+    def response_meta(self, url: str, response: requests.Response) -> dict:
+        return {
+            "url":           url,
+            "stored":        time.time(),
+            "etag":          response.headers.get("ETag"),
+            "last_modified": response.headers.get("Last-Modified"),
+            "encoding":      response.encoding,
+            "headers":       {k: v for k, v in response.headers.items() if k.lower() in ("content-type", "etag", "last-modified")},
+        }
+
+    def store(self, url: str, response: requests.Response) -> None:
+        self.write_entry(self.key_for(url), self.response_meta(url, response), response.content)
+
+    def store_streaming(self, url: str, response: requests.Response) -> None:
+        """
+        Caches a stream=True response as its body is consumed: iter_content (which .content
+        also uses) writes every chunk to a temporary entry that replaces the cached one
+        only once the whole body has been read.
+        """
+        meta = self.response_meta(url, response)
+        iter_content = response.iter_content
+
+        def tee_content(chunk_size: int = 1, decode_unicode: bool = False):
+            chunks = self.write_chunks(self.key_for(url), meta, iter_content(chunk_size))
+            if decode_unicode:
+                return requests.utils.stream_decode_response_unicode(chunks, response)
+            return chunks
+
+        response.iter_content = tee_content
+
+    def write_chunks(self, key: str, meta: dict, chunks: Iterable[bytes]) -> Iterator[bytes]:
+        header = json.dumps(meta).encode("utf-8") + b"\n"
+        descriptor, temporary = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        size = len(header)
+        complete = False
+        try:
+            with os.fdopen(descriptor, "wb") as outfile:
+                outfile.write(header)
+                for chunk in chunks:
+                    outfile.write(chunk)
+                    size += len(chunk)
+                    yield chunk
+            os.replace(temporary, self.entry_path(key))
+            complete = True
+        finally:
+            # A body abandoned or broken part way leaves the previous entry in place
+            if not complete:
+                try:
+                    os.remove(temporary)
+                except OSError:
+                    pass
+        self.record_entry(key, meta, size)
+
+    def revalidated(self, url: str, meta: dict, body: BinaryIO) -> None:
+        """ Restarts the TTL of an entry the server answered 304 for; body is rewound for reuse """
+        start = body.tell()
+        meta["stored"] = time.time()
+        try:
+            for _ in self.write_chunks(self.key_for(url), meta, iter(lambda: body.read(CACHE_COPY_SIZE), b"")):
+                pass
+        except OSError:
+            pass
+        body.seek(start)
+
+    def write_entry(self, key: str, meta: dict, body: bytes) -> None:
+        header = json.dumps(meta).encode("utf-8") + b"\n"
+        descriptor, temporary = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        with os.fdopen(descriptor, "wb") as outfile:
+            outfile.write(header)
+            outfile.write(body)
+        os.replace(temporary, self.entry_path(key))
+        self.record_entry(key, meta, len(header) + len(body))
+
+    def record_entry(self, key: str, meta: dict, size: int) -> None:
+        with self.lock:
+            if key in self.index:
+                self.total_bytes -= self.index[key][0]
+            self.index[key] = [size, time.time(), urllib.parse.urlsplit(meta["url"]).path]
+            self.total_bytes += size
+            self.evict()
+
+    def evict(self) -> None:
+        """ Drops least recently used entries until the cache fits in max_bytes; caller holds the lock """
+        if self.total_bytes <= self.max_bytes:
+            return
+        for key in sorted(self.index, key=lambda k: self.index[k][1]):
+            self.remove(key)
+            if self.total_bytes <= self.max_bytes:
+                return
+
+    def remove(self, key: str) -> None:
+        size, _, _ = self.index.pop(key)
+        self.total_bytes -= size
+        try:
+            os.remove(self.entry_path(key))
+        except OSError:
+            pass
+
+    def invalidate(self, url: str) -> None:
+        """
+        Drops cached listings whose path is the written path or one of its parents, and every
+        listing of the kinds CACHE_INVALIDATIONS relates to the written path (/REST read as /data)
+        """
+        written = re.sub(r"/REST(?=/)", "/data", urllib.parse.urlsplit(url).path, count=1).rstrip("/")
+        related = [listings for pattern, listings in CACHE_INVALIDATIONS if pattern.search(written)]
+        with self.lock:
+            for key in [k for k, (_, _, path) in self.index.items()
+                        if written == path.rstrip("/") or written.startswith(path.rstrip("/") + "/")
+                        or any(listings.search(path) for listings in related)]:
+                self.remove(key)
+
+def extract_metadata_cache(args: argparse.Namespace) -> Union[MetadataCache, None]:
+    """ Builds the MetadataCache from --cache-dir, --cache-size (MB), --cache-ttl and --refresh """
+    cache_dir = getattr(args, "cache_dir", None)
+    if cache_dir is None:
+        return None
+
+    user = getattr(args, "user", None) or xnat_cli_scripts.cli_common.extract_auth_user(args)
+    cache_size = getattr(args, "cache_size", None) or 256
+    return MetadataCache(os.path.expanduser(cache_dir),
+                         namespace=f"{args.url}|{user}",
+                         max_bytes=int(cache_size * 1024 * 1024),
+                         refresh=getattr(args, "refresh", False),
+                         ttl=getattr(args, "cache_ttl", None))
+
+
+# Incremental parsing of ResultSet listings
+
+RESULT_ARRAY_PATTERN = re.compile(r'"Result"\s*:\s*\[')
+RESULT_CHUNK_SIZE = 256 * 1024
+
+@functools.lru_cache(maxsize=None)
+def result_row_type(fields: Tuple[str, ...]) -> type:
+    """ namedtuple class of a ResultSet projection; xsi paths such as xnat:imagescandata/id become xnat_imagescandata_id """
+    return collections.namedtuple("ResultRow", [re.sub(r"\W", "_", field) for field in fields], rename=True)
+
+def iterate_result_rows(chunks: Iterable[str], fields: Sequence[str]) -> Iterator[tuple]:
+    """
+    Yields a namedtuple of fields ('' when absent) per object of ResultSet.Result as the text
+    chunks arrive, so memory holds one chunk of rows rather than the whole listing.
+    The complete rows of a chunk are decoded together by json.loads, which only succeeds
+    when the cut at the chunk's last '}' is a row boundary; otherwise rows are decoded one
+    at a time until the next chunk.
+    """
+    make_row = result_row_type(tuple(fields))._make
+    blanks = ("",) * len(fields)
+    decoder = json.JSONDecoder()
+    chunks = iter(chunks)
+    buffer = ""
+    position = None          # index in buffer inside the Result array, once it is found
+    batch = True
+    exhausted = False
+
+    while True:
+        if position is None:
+            match = RESULT_ARRAY_PATTERN.search(buffer)
+            if match is not None:
+                position = match.end()
+                continue
+        else:
+            while position < len(buffer) and buffer[position] in " \t\r\n,":
+                position += 1
+            if position < len(buffer):
+                if buffer[position] == "]":
+                    return
+                end = buffer.rfind("}") + 1 if batch else 0
+                if end > position:
+                    try:
+                        rows = json.loads("[" + buffer[position:end] + "]")
+                    except json.JSONDecodeError:
+                        batch = False
+                    else:
+                        position = end
+                        yield from [make_row(map(row.get, fields, blanks)) for row in rows]
+                        continue
+                try:
+                    row, position = decoder.raw_decode(buffer, position)
+                except json.JSONDecodeError:
+                    # An object split across chunks; a malformed one fails once the body has ended
+                    if exhausted:
+                        raise
+                else:
+                    yield make_row(map(row.get, fields, blanks))
+                    continue
+
+        if exhausted:
+            raise ValueError("Response ended before the end of ResultSet.Result")
+        chunk = next(chunks, None)
+        batch = True
+        if chunk is None:
+            exhausted = True
+        elif position is None:
+            # Only the tail can still hold a "Result" key split across chunks
+            buffer = buffer[-16:] + chunk
+        else:
+            buffer = buffer[position:] + chunk
+            position = 0
+
+
+# Lightweight REST session for commands that only use raw paths (no xnat object model)
+
+class RestResponseError(Exception):
+    """ A response whose status was not accepted; carries status_code and url like xnat's XNATResponseError """
+    def __init__(self, message: str, status_code: int, url: str):
+        super().__init__(message)
+        self.status_code = status_code
+        self.url = url
+
+# Seconds to wait for the server to connect or send data, as xnatpy's default_timeout
+DEFAULT_TIMEOUT = 300
+
+
+class RestSession:
+    """
+    requests.Session authenticated with an XNAT JSESSION cookie, offering the subset of
+    the XNATSession API the commands use: get, get_json, put, delete and disconnect.
+    The JSESSION ID is kept in token_file (mode 0600) and reused by later invocations;
+    when the server answers 401 the session logs in again (asking password_source for
+    the password only then) and the request is retried once. Every request times out
+    after timeout seconds without data from the server.
+    """
+    def __init__(self, server: str, user: str, password_source: Callable[[], Union[str, None]],
+                 token_file: Union[str, None] = None, timeout: float = DEFAULT_TIMEOUT):
+        self.server = server.rstrip("/")
+        self.user = user
+        self.password_source = password_source
+        self.token_file = token_file
+        self.timeout = timeout
+        self.interface = requests.Session()
+        self.login_lock = threading.Lock()
+        self.jsession = None
+        self.password = None
+        self.login_error = None
+
+        if token_file is not None:
+            try:
+                with open(token_file, "r") as infile:
+                    self.use_jsession(infile.read().strip() or None)
+            except OSError:
+                pass
+
+    def use_jsession(self, jsession: Union[str, None]) -> None:
+        self.jsession = jsession
+        if jsession is not None:
+            self.interface.cookies.set("JSESSIONID", jsession)
+
+    def login(self, stale_jsession: Union[str, None] = None) -> None:
+        """
+        Creates a new JSESSION unless another thread already replaced stale_jsession.
+        The password is asked for once per session and a failed login is not repeated
+        by the other workers.
+        """
+        with self.login_lock:
+            if self.jsession is not None and self.jsession != stale_jsession:
+                return
+            if self.login_error is not None:
+                raise self.login_error
+            try:
+                self.create_jsession()
+            except Exception as e:
+                self.login_error = e
+                raise
+
+    def create_jsession(self) -> None:
+        self.interface.cookies.clear()
+        if self.password is None:
+            self.password = self.password_source() or ""
+        auth = (self.user, self.password)
+        response = self.interface.post(f"{self.server}/data/JSESSION", auth=auth, timeout=self.timeout)
+        if response.status_code in (404, 405):
+            response = self.interface.put(f"{self.server}/data/services/auth", timeout=self.timeout,
+                                          data={"username": auth[0], "password": auth[1]})
+        jsession = response.text.strip()
+        if response.status_code != 200 or not jsession or len(jsession) > 256 or "<" in jsession:
+            raise RestResponseError(f"Login as {self.user} to {self.server} failed (status {response.status_code})",
+                                    response.status_code, response.url)
+
+        self.use_jsession(jsession)
+        if self.token_file is not None:
+            os.makedirs(os.path.dirname(self.token_file), mode=0o700, exist_ok=True)
+            descriptor = os.open(self.token_file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            with os.fdopen(descriptor, "w") as outfile:
+                outfile.write(jsession)
+
+    def request(self, method: str, path: str, format: Union[str, None] = None, query: Union[dict, None] = None,
+                accepted_status: Sequence[int] = (200,), timeout: Union[float, None] = None, **kwargs) -> requests.Response:
+        url = path if path.startswith(("http://", "https://")) else self.server + path
+        params = dict(query or {})
+        if format is not None:
+            params["format"] = format
+        timeout = timeout if timeout is not None else self.timeout
+
+        if self.jsession is None:
+            self.login()
+        jsession = self.jsession
+        response = self.interface.request(method, url, params=params, timeout=timeout, **kwargs)
+        if response.status_code == 401:
+            response.close()
+            self.login(stale_jsession=jsession)
+            response = self.interface.request(method, url, params=params, timeout=timeout, **kwargs)
+
+        if response.status_code not in accepted_status:
+            response.close()
+            raise RestResponseError(f"Invalid status for response from {url} "
+                                    f"(status {response.status_code}, accepted status: {list(accepted_status)})",
+                                    response.status_code, response.url)
+        return response
+
+    def get(self, path: str, format: Union[str, None] = None, query: Union[dict, None] = None,
+            accepted_status: Union[Sequence[int], None] = None, timeout: Union[float, None] = None,
+            headers: Union[dict, None] = None, stream: bool = False) -> requests.Response:
+        return self.request("GET", path, format, query, accepted_status or (200,), timeout, headers=headers, stream=stream)
+
+    def get_json(self, uri: str, query: Union[dict, None] = None, accepted_status: Union[Sequence[int], None] = None) -> Any:
+        return self.get(uri, format="json", query=query, accepted_status=accepted_status).json()
+
+    @staticmethod
+    def listing_query(columns: str, project_id: Union[str, None] = None) -> dict:
+        """ Query of a /data/subjects or /data/experiments listing: columns, limited to project_id when given """
+        query = {"columns": columns}
+        if project_id is not None:
+            query["project"] = project_id
+        return query
+
+    def iter_result_set(self, uri: str, fields: Sequence[str], query: Union[dict, None] = None) -> Iterator[tuple]:
+        """
+        Streams the ResultSet rows of a JSON listing as namedtuples of fields, parsed while
+        the body downloads; the request is made when iteration starts.
+        """
+        response = self.get(uri, format="json", query=query, stream=True)
+        try:
+            if response.encoding is None:
+                response.encoding = "utf-8"
+            chunks = response.iter_content(RESULT_CHUNK_SIZE, decode_unicode=True)
+            yield from iterate_result_rows(chunks, fields)
+            # Reading the short tail after the rows completes the body (and its cache entry)
+            for _ in chunks:
+                pass
+        finally:
+            response.close()
+
+    def put(self, path: str, data: Any = None, json: Any = None, format: Union[str, None] = None,
+            query: Union[dict, None] = None, accepted_status: Union[Sequence[int], None] = None,
+            timeout: Union[float, None] = None, headers: Union[dict, None] = None) -> requests.Response:
+        return self.request("PUT", path, format, query, accepted_status or (200, 201), timeout,
+                            data=data, json=json, headers=headers)
+
+    def delete(self, path: str, headers: Union[dict, None] = None, accepted_status: Union[Sequence[int], None] = None,
+               query: Union[dict, None] = None, timeout: Union[float, None] = None) -> requests.Response:
+        return self.request("DELETE", path, None, query, accepted_status or (200,), timeout, headers=headers)
+
+    def disconnect(self) -> None:
+        """ Closes the pooled connections; the JSESSION stays valid for the next invocation """
+        self.interface.close()
+
+def session_token_file(server: str, user: str) -> str:
+    """ ~/.cache/xnat_cli_scripts/jsession-<hash of server and user> (XDG_CACHE_HOME is honoured) """
+    cache_home = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    key = hashlib.sha256(f"{server.rstrip('/')}|{user}".encode("utf-8")).hexdigest()[:24]
+    return os.path.join(cache_home, "xnat_cli_scripts", f"jsession-{key}")
+
+def netrc_password(server: str, user: str) -> Union[str, None]:
+    """ Password for user on the server host from $NETRC or ~/.netrc, if listed there """
+    import netrc
+    host = urllib.parse.urlsplit(server).netloc
+    try:
+        authenticators = netrc.netrc(os.environ.get("NETRC")).authenticators(host)
+    except (OSError, netrc.NetrcParseError):
+        return None
+    if authenticators is None or (authenticators[0] and authenticators[0] != user):
+        return None
+    return authenticators[2]
+
+def connect(args: argparse.Namespace) -> RestSession:
+    """
+    Opens a RestSession for --xnat with the same hooks as install_session_hooks; commands
+    that only call raw REST paths use it in place of xnat.connect, skipping the xnat
+    handshake and object model.
+    The user comes from -u or -a; the password from -a user:password, -p, the netrc file
+    or an interactive prompt, in that order, and is only needed when no cached
+    JSESSION is valid. --fresh-login ignores the cached JSESSION; --timeout replaces
+    DEFAULT_TIMEOUT.
+    """
+    user = getattr(args, "user", None) or xnat_cli_scripts.cli_common.extract_auth_user(args)
+    password = xnat_cli_scripts.cli_common.extract_auth_password(args) if getattr(args, "auth", None) else None
+
+    def password_source() -> Union[str, None]:
+        if password is not None:
+            return password
+        found = netrc_password(args.url, user)
+        if found is not None:
+            return found
+        import getpass
+        return getpass.getpass(f"Please enter the password for user '{user}': ")
+
+    token_file = session_token_file(args.url, user)
+    if getattr(args, "fresh_login", False):
+        try:
+            os.remove(token_file)
+        except OSError:
+            pass
+
+    session = RestSession(args.url, user, password_source, token_file, getattr(args, "timeout", None) or DEFAULT_TIMEOUT)
+    install_session_hooks(session, args)
+    return session
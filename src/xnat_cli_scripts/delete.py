@@ -30,16 +30,13 @@ import argparse
 
 #import click
 #import fabric
-import xnat
-import xnat.core
-import xnat.mixin
 #import yaml
 
 
 
 
 
-if __name__ == "__main__":
+def main() -> None:
     parser = argparse.ArgumentParser(description="Delete objects from an XNAT system")
     parser.add_argument("list")
     parser.add_argument('-u', '--url',   dest='url',   help="URL to XNAT, default is https://cnda.wustl.edu")
@@ -49,3 +46,7 @@ if __name__ == "__main__":
     args.url = "https://cnda.wustl.edu" if args.url is None else args.url
 
     print(args.url, args.list)
+
+
+if __name__ == "__main__":
+    main()
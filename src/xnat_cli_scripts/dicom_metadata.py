@@ -3,70 +3,317 @@
 dicom_metadata.py
 ---
 --------------------------------------------------------------------------------
-This application extracts metadata from a DICOM file and formats per a profile
+This application extracts metadata from DICOM files and formats per a profile
 
 Example usage of the CLI:
 ```bash
-$ python3  [SCOPE]
+$ python3 -m xnat_cli_scripts.dicom_metadata -e -f image.dcm
+$ python3 -m xnat_cli_scripts.dicom_metadata -e -d /archive/study --workers 8
+$ find /archive -name '*.dcm' | python3 -m xnat_cli_scripts.dicom_metadata -e -l -
+$ python3 -m xnat_cli_scripts.dicom_metadata -e -d /archive/study -p series --format jsonl
 ```
 """
 
+from __future__ import annotations
+
 __version__ = (1, 0, 0)
 
 import argparse
-import pydicom
-from pydicom import dcmread
-import csv
+import functools
+import json
+import os
+import sys
+from typing import TYPE_CHECKING, Iterator
 
+import xnat_cli_scripts.cli_common
 
-def extract_metadata(args) -> None:
-    if (args.filename is None):
-        print("Missing --filename option in the extract function")
-        return
+# pydicom is imported where it is used, so --help and argument errors do not load it
+if TYPE_CHECKING:
+    import pydicom.dataset
 
-    tags = [0x00100010,
-            0x00100020,
-            0x00080016,
-            0x00080020,
-            0x00080030,
-            0x00081010,
-            0x0020000D]
 
-    with open(args.filename, 'rb') as infile:
-        output_str = ""
-        delimiter_str = ""
-        ds = dcmread(infile)
-        for t in tags:
-            gggg = (t >> 16) & 0xffff
-            eeee = (t)       & 0xffff
-            value_string = "'None'"
-            if t in ds:
-                v = ds[gggg, eeee]
-                value_string = repr(v.value)
+# Built-in profiles: (column name, tag, formatter name) per output column
+PROFILES = {
+    "default": [
+        ("PatientName",        0x00100010, "pn"),
+        ("PatientID",          0x00100020, "str"),
+        ("SOPClassUID",        0x00080016, "uid"),
+        ("StudyDate",          0x00080020, "date"),
+        ("StudyTime",          0x00080030, "time"),
+        ("StationName",        0x00081010, "str"),
+        ("StudyInstanceUID",   0x0020000D, "uid"),
+    ],
+    "study": [
+        ("StudyInstanceUID",   0x0020000D, "uid"),
+        ("StudyDate",          0x00080020, "date"),
+        ("StudyTime",          0x00080030, "time"),
+        ("AccessionNumber",    0x00080050, "str"),
+        ("StudyDescription",   0x00081030, "str"),
+        ("PatientID",          0x00100020, "str"),
+    ],
+    "series": [
+        ("StudyInstanceUID",   0x0020000D, "uid"),
+        ("SeriesInstanceUID",  0x0020000E, "uid"),
+        ("SeriesNumber",       0x00200011, "int"),
+        ("Modality",           0x00080060, "str"),
+        ("SeriesDescription",  0x0008103E, "str"),
+        ("SOPInstanceUID",     0x00080018, "uid"),
+    ],
+}
 
-            output_str = output_str + delimiter_str + value_string
-            delimiter_str = "\t"
+# Elements larger than this are not read unless their value is requested
+DEFER_SIZE = 1024
 
-#        if 'OriginalAttributesSequence' in ds:
-#            original_attributes_sequence = ds.get('OriginalAttributesSequence')
 
-        print(f"{args.filename}\t{output_str}")
+def format_str(value) -> str:
+    import pydicom.multival
+    if isinstance(value, pydicom.multival.MultiValue):
+        return "\\".join(str(v) for v in value)
+    return str(value)
 
+def format_date(value) -> str:
+    """ YYYYMMDD -> YYYY-MM-DD; anything else is written as found """
+    text = format_str(value)
+    if len(text) == 8 and text.isdigit():
+        return f"{text[0:4]}-{text[4:6]}-{text[6:8]}"
+    return text
 
+def format_time(value) -> str:
+    """ HHMMSS[.ffffff] -> HH:MM:SS[.ffffff]; anything else is written as found """
+    text = format_str(value)
+    if len(text) >= 6 and text[:6].isdigit():
+        return f"{text[0:2]}:{text[2:4]}:{text[4:]}"
+    return text
 
-    x = ""
+def format_numbers(value, convert) -> str:
+    """ Applies convert to each value of a multi-value; values it rejects are written as found """
+    import pydicom.multival
+    values = value if isinstance(value, pydicom.multival.MultiValue) else [value]
+    texts = []
+    for v in values:
+        try:
+            texts.append(convert(v))
+        except (TypeError, ValueError):
+            texts.append(str(v))
+    return "\\".join(texts)
 
+def format_int(value) -> str:
+    """ IS/US/SS/UL values as plain integers: " 0012" -> 12 """
+    return format_numbers(value, lambda v: str(int(v)))
 
-if __name__ == "__main__":
-    parser = argparse.ArgumentParser(description="List projects from an XNAT system")
+def format_float(value) -> str:
+    """ DS/FL/FD values in their shortest round-trip form: "0.500000" -> 0.5, "1E3" -> 1000.0 """
+    return format_numbers(value, lambda v: repr(float(v)))
+
+FORMATTERS = {
+    "str":   format_str,
+    "pn":    format_str,
+    "uid":   format_str,
+    "int":   format_int,
+    "float": format_float,
+    "date":  format_date,
+    "time":  format_time,
+}
+
+
+class CompiledProfile:
+    """
+    Tag lookup built once per run from a profile and shared by every file of a batch:
+    BaseTag keys, the matching formatter functions, the column names and the largest
+    tag (where header parsing can stop).
+    """
+    __slots__ = ("names", "tags", "formatters", "max_tag")
+
+    def __init__(self, columns: list):
+        import pydicom.tag
+        self.names = [name for name, _, _ in columns]
+        self.tags = [pydicom.tag.Tag(tag) for _, tag, _ in columns]
+        self.formatters = [FORMATTERS[formatter] for _, _, formatter in columns]
+        self.max_tag = max(self.tags)
+
+    def __getstate__(self):
+        return (self.names, self.tags, self.formatters, self.max_tag)
+
+    def __setstate__(self, state):
+        self.names, self.tags, self.formatters, self.max_tag = state
+
+    def format(self, ds: pydicom.dataset.Dataset) -> list:
+        values = []
+        for tag, formatter in zip(self.tags, self.formatters):
+            value = ds[tag].value if tag in ds else None
+            values.append("" if value is None else formatter(value))
+        return values
+
+
+def parse_profile_tag(tag) -> int:
+    """ Accepts 0x00100020, "00100020", "(0010,0020)", "0010,0020" or a keyword such as "PatientID" """
+    if isinstance(tag, int):
+        return tag
+
+    text = str(tag).strip().strip("()").replace(",", "").replace(" ", "")
+    if len(text) == 8:
+        try:
+            return int(text, 16)
+        except ValueError:
+            pass
+
+    import pydicom.datadict
+    keyword_tag = pydicom.datadict.tag_for_keyword(str(tag).strip())
+    if keyword_tag is None:
+        raise ValueError(f"Unrecognized DICOM tag in profile: {tag}")
+    return keyword_tag
+
+
+def load_profile(profile: str) -> CompiledProfile:
+    """
+    Compiles a built-in profile by name, or a JSON/YAML profile file with entries
+    {"name": ..., "tag": ..., "format": ...} given as a list or under "columns".
+    """
+    if profile is None:
+        profile = "default"
+    if profile in PROFILES:
+        return CompiledProfile(PROFILES[profile])
+
+    if not os.path.isfile(profile):
+        raise ValueError(f"Profile is neither a built-in ({', '.join(PROFILES)}) nor a file: {profile}")
+
+    with open(profile, 'r') as infile:
+        if profile.endswith((".yaml", ".yml")):
+            try:
+                import yaml
+            except ImportError:
+                raise ValueError(f"{profile} needs PyYAML; install it (pip install pyyaml) or write the profile as JSON") from None
+            try:
+                definition = yaml.safe_load(infile)
+            except yaml.YAMLError as e:
+                raise ValueError(f"{profile} is not valid YAML: {e}") from None
+        else:
+            definition = json.load(infile)
+
+    if isinstance(definition, dict):
+        definition = definition.get("columns", [])
+
+    import pydicom.datadict
+    columns = []
+    for entry in definition:
+        tag = parse_profile_tag(entry["tag"])
+        name = entry.get("name") or pydicom.datadict.keyword_for_tag(tag) or f"{tag:08X}"
+        formatter = entry.get("format", "str")
+        if formatter not in FORMATTERS:
+            raise ValueError(f"Unknown format '{formatter}' for {name}; expected one of {', '.join(FORMATTERS)}")
+        columns.append((name, tag, formatter))
+
+    if not columns:
+        raise ValueError(f"Profile file defines no columns: {profile}")
+    return CompiledProfile(columns)
+
+
+# The compiled profile of the current process, set once per worker by use_profile
+_profile = None
+
+def use_profile(profile: CompiledProfile) -> None:
+    global _profile
+    _profile = profile
+
+
+def read_header(infile, profile: CompiledProfile) -> pydicom.dataset.FileDataset:
+    """
+    Parses only the elements needed for the profile: reading stops at the first top-level
+    element past the largest requested tag (so always before Pixel Data), other
+    elements are skipped by specific_tags and large values are deferred.
+    """
+    import pydicom.filereader
+    max_tag = profile.max_tag
+    return pydicom.filereader.read_partial(infile,
+                                           stop_when=lambda tag, vr, length: tag > max_tag,
+                                           defer_size=DEFER_SIZE,
+                                           specific_tags=profile.tags)
+
+
+def extract_file_metadata(filename: str, full_parse: bool = False) -> list:
+    """ Returns [filename, value, ...] for the active profile; raises when the file cannot be read as DICOM """
+    import pydicom
+    with open(filename, 'rb') as infile:
+        if full_parse:
+            ds = pydicom.dcmread(infile)
+        else:
+            ds = read_header(infile, _profile)
+        return [filename] + _profile.format(ds)
+
+
+def iterate_directory(directory: str) -> Iterator[str]:
+    """ Yields every file below directory, walking folders and files in sorted order """
+    for root, dirnames, filenames in os.walk(directory):
+        dirnames.sort()
+        for filename in sorted(filenames):
+            yield os.path.join(root, filename)
+
+
+def iterate_file_list(list_file: str) -> Iterator[str]:
+    """ Yields the file names listed one per line in list_file ('-' reads stdin) """
+    infile = sys.stdin if list_file == "-" else open(list_file, 'r')
+    try:
+        for line in infile:
+            filename = line.strip()
+            if filename:
+                yield filename
+    finally:
+        if infile is not sys.stdin:
+            infile.close()
+
+
+def extract_metadata(args) -> None:
+    if (args.filename is not None):
+        filenames = iter([args.filename])
+    elif (args.directory is not None):
+        filenames = iterate_directory(args.directory)
+    elif (args.list_file is not None):
+        filenames = iterate_file_list(args.list_file)
+    else:
+        print("Missing --filename, --directory or --list option in the extract function")
+        return
+
+    try:
+        profile = load_profile(args.profile)
+    except (OSError, ValueError, KeyError) as e:
+        print(f"[ERROR] Invalid profile: {xnat_cli_scripts.cli_common.format_error(e)}")
+        return
+
+    # Files are parsed in a process pool; rows come back in input order and an
+    # unreadable or non-DICOM file becomes an ERROR row instead of stopping the batch
+    workers = 1 if args.filename is not None else xnat_cli_scripts.cli_common.extract_workers(args)
+    extract_file = functools.partial(extract_file_metadata, full_parse=args.full_parse)
+    with xnat_cli_scripts.cli_common.open_row_writer(args, ["Filename"] + profile.names) as writer:
+        for filename, values, error in xnat_cli_scripts.cli_common.ordered_map(extract_file, filenames, workers, processes=True,
+                                                                                 initializer=use_profile, initargs=(profile,)):
+            if error is not None:
+                writer.error([filename], xnat_cli_scripts.cli_common.format_error(error))
+                continue
+            writer.row(*values)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Extract metadata from DICOM files")
     parser.add_argument('-e', '--extract',         dest='extract_flag',    help="Action is to extract metadata",    action='store_true')
-    parser.add_argument('-p', '--profile',         dest='profile',         help="Optional profile name to format output")
-    parser.add_argument('-f', '--filename',        dest='filename',        help="Name of DICOM file to examine",    required=True)
+    parser.add_argument('-p', '--profile',         dest='profile',         help="Built-in profile (default, study, series) or JSON/YAML profile file")
+    parser.add_argument('-f', '--filename',        dest='filename',        help="Name of DICOM file to examine")
+    parser.add_argument('-d', '--directory',       dest='directory',       help="Directory searched recursively for DICOM files")
+    parser.add_argument('-l', '--list',            dest='list_file',       help="File with one DICOM file name per line ('-' for stdin)")
+    parser.add_argument('-w', '--workers',         dest='workers',         help="Number of worker processes (default: CPU count)", type=int)
+    parser.add_argument(      '--full',            dest='full_parse',      help="Parse the whole dataset including Pixel Data (slow; for comparison)", action='store_true')
+    parser.add_argument(      '--format',          dest='output_format',   help="Row format: tsv (default), csv or jsonl", choices=xnat_cli_scripts.cli_common.ROW_FORMATS)
+    parser.add_argument(      '--output',          dest='output_file',     help="Write rows to this file instead of stdout")
 
     args = parser.parse_args()
 
+    if args.workers is None:
+        args.workers = os.cpu_count()
+
     if args.extract_flag:
         extract_metadata(args)
     else:
         print("No action specified among the command line options")
 
+
+if __name__ == "__main__":
+    main()
@@ -10,67 +10,69 @@ Example usage:
     List all projects:
         python3 -m xnat_cli_scripts.projects -L
 
+    List the subjects of two projects with their experiment counts:
+        python3 -m xnat_cli_scripts.projects -L --subjects --project PRJ1,PRJ2
+
 __version__ = (1, 0, 0)
 
 """
 
+from __future__ import annotations
+
 import argparse
-import requests
-import xnat
-import xnat.core
-import xnat.mixin
-from xnat.session import XNATSession
+import collections
 import csv
-import time
+import functools
+import sys
 import warnings
+from typing import TYPE_CHECKING
 import xnat_cli_scripts.cli_common
 warnings.filterwarnings('ignore')
 
+if TYPE_CHECKING:
+    from xnat_cli_scripts.cli_session import RestSession
 
 
-# Time Helper Function
 
-def apply_sleep(args: argparse.Namespace) -> None:
-    """ Applies sleep if -s is specified """
-    if args.sleep:
-        try:
-            sleep_time = float(args.sleep)
-            if sleep_time > 0:
-                time.sleep(sleep_time)
-        except ValueError:
-            print("[ERROR] Invalid sleep value. Please provide a valid number.")
+def format_project_columns(args: argparse.Namespace) -> list:
+    if (args.brief_format is True):
+        return ["ID"]
+    elif (args.verbose is False):
+        return ["ID", "Name", "Subject Count"]
+    return ["ID", "Name", "Subject Count", "Experiment Count", "PI"]
 
+# Fields of the /data/projects rows used by the project listing
+PROJECT_LISTING_FIELDS = ("ID", "name", "pi_firstname", "pi_lastname")
 
-def format_project_header_rows() -> str:
-    return "ID\tName\tInsert Date\tSubject Count\tExperiment Count\PI"
-def format_project_data(project_json, project_object, args: argparse.Namespace) -> str:
-    formatted_string=""
+def format_project_data(project, subject_counts, experiment_counts, args: argparse.Namespace) -> list:
+    project_id = project.ID
     if (args.brief_format is True):
-        formatted_string = project_object.id
+        return [project_id]
     elif (args.verbose is False):
-        formatted_string = f"{project_object.id}\t{project_object.name}\t{len(project_object.subjects)}"
-    else:
-        pi_string = f"{project_json['pi_lastname']}, {project_json['pi_firstname']}"
-        if (pi_string) == ", ":
-            pi_string = "NONE"
-        experiment_count = "Unknown"
-        try:
-            experiment_count = len(project_object.experiments)
-        except KeyError:
-            experiment_count = "Unknown"
-        except requests.exceptions.ReadTimeout:
-            experiment_count = "Unknown"
+        return [project_id, project.name, subject_counts[project_id]]
 
-        formatted_string = f"{project_object.id}\t{project_object.name}\t{len(project_object.subjects)}\t{experiment_count}\t{pi_string}"
+    pi_string = f"{project.pi_lastname}, {project.pi_firstname}"
+    if (pi_string) == ", ":
+        pi_string = "NONE"
+    experiment_count = "Unknown"
+    if experiment_counts is not None:
+        experiment_count = experiment_counts[project_id]
 
-    return formatted_string
+    return [project_id, project.name, subject_counts[project_id], experiment_count, pi_string]
 
-def format_project_id_name(p) -> str:
-    return f"{p.id}, {p.name}"
+def fetch_project_counts(connection: RestSession, listing_uri: str) -> collections.Counter:
+    """
+    Counts the rows of an archive-wide listing (/data/subjects, /data/experiments) per project
+    with one request, instead of hydrating every project object to call len() on it.
+    """
+    return collections.Counter(row.project for row in connection.iter_result_set(listing_uri, ("project",), {"columns": "ID,project"}))
 
 
-def execute_list_projects(connection: xnat.session.XNATSession, args: argparse.Namespace) -> None:
-    
+
+def execute_list_projects(connection: RestSession, args: argparse.Namespace) -> None:
+    # List all projects as usual; rows are parsed as the listing streams in
+    result = connection.iter_result_set("/data/projects", PROJECT_LISTING_FIELDS)
+
     if args.csv_file:
         # Read project IDs from CSV file
         project_ids = []
@@ -79,30 +81,37 @@ def execute_list_projects(connection: xnat.session.XNATSession, args: argparse.N
             for row in csv_reader:
                 project_ids.append(row[0])  # Assuming the project ID is in the first column
 
-        # List only the projects from the CSV
-        for project_id in project_ids:
-            project_object = session.projects.get(project_id)
-            if project_object:
-                print(format_project_data({}, project_object, args))
-                # Apply sleep after processing each project
-                apply_sleep(args)
-    else:
-        # List all projects as usual
-        all_projects = session.get_json(f"/data/projects")
-        # Apply sleep after the REST call (moved up here)
-        apply_sleep(args)
+        # List only the projects from the CSV, in CSV order
+        projects_by_id = {project.ID: project for project in result}
+        result = [projects_by_id[project_id] for project_id in project_ids if project_id in projects_by_id]
+
+    # Counts come from one bulk listing each and are joined to /data/projects in memory
+    subject_counts = None
+    experiment_counts = None
+    if (args.brief_format is not True):
+        import requests
+        subject_counts = fetch_project_counts(connection, "/data/subjects")
+        if (args.verbose is True):
+            try:
+                experiment_counts = fetch_project_counts(connection, "/data/experiments")
+            except (requests.exceptions.ReadTimeout, requests.exceptions.ConnectionError):
+                # A timeout while the listing streams surfaces as ConnectionError
+                experiment_counts = None
+
+    with xnat_cli_scripts.cli_common.open_row_writer(args, format_project_columns(args)) as writer:
+        for project in result:
+            writer.row(*format_project_data(project, subject_counts, experiment_counts, args))
 
-        result_set = all_projects['ResultSet']
-        result = result_set['Result']
 
-        for project_json in result:
-            project_object = session.projects[project_json['ID']]
-            print(format_project_data(project_json, project_object, args))
-            # Apply sleep after processing each project
-            apply_sleep(args)
+def fetch_project_users(connection: RestSession, project_id: str) -> list:
+    """ Returns the ResultSet rows of /data/projects/{project_id}/users """
+    users = connection.get_json(f"/data/projects/{project_id}/users")
 
+    user_result_set = users['ResultSet']
+    return user_result_set['Result']
 
-def execute_list_project_users(connection: xnat.session.XNATSession, args: argparse.Namespace) -> None:
+
+def execute_list_project_users(connection: RestSession, args: argparse.Namespace) -> None:
     # Check if CSV file is provided
     if args.csv_file:  # Correctly reference args.csv_file
         # Read the CSV file and get the list of project IDs
@@ -115,38 +124,29 @@ def execute_list_project_users(connection: xnat.session.XNATSession, args: argpa
     else:
         project_ids_from_csv = None
 
-    all_projects = session.get_json(f"/data/projects")
-    # Apply sleep after the main REST call
-    apply_sleep(args)
+    all_projects = connection.get_json(f"/data/projects")
 
     result_set = all_projects['ResultSet']
     result = result_set['Result']
 
-    for project_json in result:
-        project_id = project_json['ID']
-
-        # If CSV is provided, only process projects in the CSV file
-        if project_ids_from_csv and project_id not in project_ids_from_csv:
-            continue
-
-        users = connection.get_json(f"/data/projects/{project_id}/users")
-        # Apply sleep after fetching users for each project
-        apply_sleep(args)
+    # If CSV is provided, only process projects in the CSV file
+    project_ids = [project_json['ID'] for project_json in result
+                   if not project_ids_from_csv or project_json['ID'] in project_ids_from_csv]
 
-        user_result_set = users['ResultSet']
-        user_results = user_result_set['Result']
+    fetch_users = functools.partial(fetch_project_users, connection)
+    workers = xnat_cli_scripts.cli_common.extract_workers(args)
+    with xnat_cli_scripts.cli_common.open_row_writer(args, ["Project ID", "Login"]) as writer:
+        for project_id, user_results, error in xnat_cli_scripts.cli_common.ordered_map(fetch_users, project_ids, workers):
+            if error is not None:
+                writer.error([project_id], xnat_cli_scripts.cli_common.format_error(error))
+                continue
 
-        for user in user_results:
-            print(f"{project_id}\t{user['login']}")
-        
-        # Apply sleep after processing each project's users
-        apply_sleep(args)
+            for user in user_results:
+                writer.row(project_id, user['login'])
 
 
-def execute_list_project_groups(connection: xnat.session.XNATSession, args: argparse.Namespace) -> None:
-    all_projects = session.get_json(f"/data/projects")
-    # Apply sleep after the main REST call
-    apply_sleep(args)
+def execute_list_project_groups(connection: RestSession, args: argparse.Namespace) -> None:
+    all_projects = connection.get_json(f"/data/projects")
 
     result_set = all_projects['ResultSet']
     result     = result_set['Result']
@@ -163,24 +163,20 @@ def execute_list_project_groups(connection: xnat.session.XNATSession, args: argp
         # Filter the results to only include the projects in the CSV
         result = [project for project in result if project['ID'] in project_ids]
 
-    for project_json in result:
-        project_id = project_json['ID']
-
-        users = connection.get_json(f"/data/projects/{project_id}/users")
-        # Apply sleep after fetching users for each project
-        apply_sleep(args)
-
-        user_result_set = users['ResultSet']
-        user_results    = user_result_set['Result']
+    fetch_users = functools.partial(fetch_project_users, connection)
+    workers = xnat_cli_scripts.cli_common.extract_workers(args)
+    project_ids = [project_json['ID'] for project_json in result]
+    with xnat_cli_scripts.cli_common.open_row_writer(args, ["Project ID", "Login", "Group ID"]) as writer:
+        for project_id, user_results, error in xnat_cli_scripts.cli_common.ordered_map(fetch_users, project_ids, workers):
+            if error is not None:
+                writer.error([project_id], xnat_cli_scripts.cli_common.format_error(error))
+                continue
 
-        for user in user_results:
-            print(f"{project_id}\t{user['login']}\t{user['GROUP_ID']}")
-        
-        # Apply sleep after processing each project's groups
-        apply_sleep(args)
+            for user in user_results:
+                writer.row(project_id, user['login'], user['GROUP_ID'])
 
 
-def execute_remove_groups(connection: XNATSession, args: argparse.Namespace) -> None:
+def execute_remove_groups(connection: RestSession, args: argparse.Namespace) -> None:
     """
     Remove groups specified in the CSV file.
     CSV Format: {project}{tab}{user}{tab}{group}
@@ -211,29 +207,26 @@ def execute_remove_groups(connection: XNATSession, args: argparse.Namespace) ->
             print(f"[ERROR] Exception while reading CSV: {e}")
             return
 
-        # Iterate over each group and remove it
+        import requests
+        from xnat_cli_scripts.cli_session import RestResponseError
+
+        # Iterate over each group and remove it; a failed row is reported and the batch goes on
         for project, user, group in groups_to_remove:
             # Construct the URL for removing the group (same style as execute_update_groups)
             remove_url = f"/data/projects/{project}/users/{group}/{user}"
 
             try:
-                # Use `connection.put()` instead of `requests.put()`
-                response = connection.delete(remove_url)
-
-                apply_sleep(args)  # Sleep after each API call
-
-                if response.status_code == 200:
-                    print(f"{project}\t{user}\t{group}\tREMOVED")
-                else:
-                    print(f"{project}\t{user}\t{group}\tERROR\t{response.status_code}: {response.text}")
-
+                connection.delete(remove_url)
+                print(f"{project}\t{user}\t{group}\tREMOVED")
+            except RestResponseError as e:
+                print(f"{project}\t{user}\t{group}\tERROR\t{xnat_cli_scripts.cli_common.format_error(e)}")
             except requests.exceptions.RequestException as e:
                 print(f"{project}\t{user}\t{group}\tERROR\tRequest failed: {e}")
 
-def execute_update_groups(connection: XNATSession, args: argparse.Namespace) -> None:
+def execute_update_groups(connection: RestSession, args: argparse.Namespace) -> None:
     """
     Force update groups for users in the specified projects based on the CSV file.
-    Uses XNATSession for authentication exactly like list_project_groups.
+    Uses the authenticated RestSession exactly like list_project_groups.
 
     CSV Format: {project_id}{tab}{user}{tab}{new_group}
     
@@ -242,6 +235,9 @@ def execute_update_groups(connection: XNATSession, args: argparse.Namespace) ->
       - "ERROR" if the request fails
     """
     if args.csv_file:
+        import requests
+        from xnat_cli_scripts.cli_session import RestResponseError
+
         try:
             with open(args.csv_file, mode='r') as file:
                 csv_reader = csv.reader(file, delimiter='\t')
@@ -256,27 +252,205 @@ def execute_update_groups(connection: XNATSession, args: argparse.Namespace) ->
                     # Construct the URL for updating the group (relative path)
                     update_url = f"/data/projects/{project_id}/users/{new_group}/{user}"
 
-                    # Use XNATSession for authentication, just like list_project_groups
-                    response = connection.put(update_url)  
-
-                    apply_sleep(args)  # Keeps delay between API calls
-
-                    # Check response and print result
-                    if response.status_code == 200:
+                    # A rejected PUT is that row's error; the remaining rows are still applied
+                    try:
+                        connection.put(update_url)
                         print(f"{project_id}\t{user}\t{new_group}\tCHANGED")
-                    else:
-                        print(f"{project_id}\t{user}\t{new_group}\tERROR\t{response.status_code}: {response.text}")
+                    except RestResponseError as e:
+                        print(f"{project_id}\t{user}\t{new_group}\tERROR\t{xnat_cli_scripts.cli_common.format_error(e)}")
+                    except requests.exceptions.RequestException as e:
+                        print(f"{project_id}\t{user}\t{new_group}\tERROR\tRequest failed: {e}")
 
         except FileNotFoundError:
             print(f"[ERROR] CSV file not found: {args.csv_file}")
-        except Exception as e:
+        except (OSError, csv.Error, ValueError) as e:
             print(f"[ERROR] Exception while reading CSV: {e}")
 
 
-def execute_list_project_accessibilities(connection: XNATSession, args: argparse.Namespace) -> None:
+def normalize_group(project_id: str, group: str) -> str:
+    """ Reduces "PRJ_owner", "owner" and "Owners" to the role name "owner" for comparison """
+    role = group.strip()
+    if role.startswith(f"{project_id}_"):
+        role = role[len(project_id) + 1:]
+    role = role.lower()
+    if role in ("owners", "members", "collaborators"):
+        role = role[:-1]
+    return role
+
+
+def read_desired_groups(desired_file: str) -> tuple:
+    """
+    Reads {project}{tab}{user}{tab}{group} rows into ({(project, user): role}, projects in scope).
+    A row with only a project puts that project in scope with no listed members.
+    """
+    desired = {}
+    scope = []
+    with open(desired_file, mode='r') as file:
+        for row in csv.reader(file, delimiter='\t'):
+            row = [value.strip() for value in row]
+            if not row or not row[0] or row[0].startswith("#"):
+                continue
+            project_id = row[0]
+            if project_id not in scope:
+                scope.append(project_id)
+            if len(row) < 3 or not row[1]:
+                continue
+
+            key = (project_id, row[1])
+            role = normalize_group(project_id, row[2])
+            if key in desired and desired[key] != role:
+                print(f"[WARNING] {project_id}\t{row[1]} is listed as both {desired[key]} and {role}; using {role}", file=sys.stderr)
+            desired[key] = role
+    return desired, scope
+
+
+def plan_group_changes(desired: dict, current: dict) -> list:
+    """
+    Compares the {(project, user): role} indexes and returns the (project, user, role, action)
+    changes, sorted: ADD and CHANGE carry the desired role, REMOVE the current one
+    """
+    changes = []
+    for key, role in desired.items():
+        current_role = current.get(key)
+        if current_role is None:
+            changes.append((*key, role, "ADD"))
+        elif current_role != role:
+            changes.append((*key, role, "CHANGE"))
+    for key, role in current.items():
+        if key not in desired:
+            changes.append((*key, role, "REMOVE"))
+    return sorted(changes)
+
+
+def apply_group_change(connection: RestSession, change: tuple) -> str:
+    project_id, user, role, action = change
+    group_url = f"/data/projects/{project_id}/users/{project_id}_{role}/{user}"
+    if action == "REMOVE":
+        connection.delete(group_url)
+        return "REMOVED"
+    connection.put(group_url)
+    return "ADDED" if action == "ADD" else "CHANGED"
+
+
+def execute_reconcile_groups(connection: RestSession, args: argparse.Namespace) -> None:
+    """
+    Brings project groups to the state listed in the --reconcile file.
+    File Format: {project}{tab}{user}{tab}{group}; every project named in the file is
+    reconciled completely, so members of those projects missing from the file are removed.
+    The logged-in user's own Owners memberships are never removed or changed (SKIPPED rows)
+    unless --allow-self-removal is given, so a file that forgets them cannot lock the user out.
+    Current memberships of the projects in scope are fetched concurrently, compared in memory,
+    and only the ADD/CHANGE/REMOVE requests needed are issued (none with --dry-run).
+    Output: {project}{tab}{user}{tab}{group}{tab}{action}{tab}{status}
+    """
+    try:
+        desired, scope = read_desired_groups(args.reconcile_file)
+    except OSError as e:
+        print(f"[ERROR] Cannot read desired groups: {xnat_cli_scripts.cli_common.format_error(e)}")
+        return
+
+    workers = xnat_cli_scripts.cli_common.extract_workers(args)
+    fetch_users = functools.partial(fetch_project_users, connection)
+    columns = ["Project ID", "Login", "Group ID", "Action", "Status"]
+    with xnat_cli_scripts.cli_common.open_row_writer(args, columns) as writer:
+        current = {}
+        reconciled = set()
+        for project_id, user_results, error in xnat_cli_scripts.cli_common.ordered_map(fetch_users, scope, workers):
+            if error is not None:
+                writer.error([project_id, "", "", "LIST"], xnat_cli_scripts.cli_common.format_error(error))
+                continue
+            reconciled.add(project_id)
+            for user in user_results:
+                current[(project_id, user['login'])] = normalize_group(project_id, user['GROUP_ID'])
+
+        # Projects whose membership could not be listed are left alone rather than guessed at
+        desired = {key: role for key, role in desired.items() if key[0] in reconciled}
+        changes = plan_group_changes(desired, current)
+        unchanged = len(desired) - sum(1 for change in changes if change[3] != "REMOVE")
+
+        own = [] if args.allow_self_removal else \
+              [change for change in changes if change[1] == connection.user and current.get(change[:2]) == "owner"]
+        for project_id, user, role, action in own:
+            writer.error([project_id, user, f"{project_id}_{role}", action],
+                         "Own Owners membership; pass --allow-self-removal to change it", status="SKIPPED")
+        changes = [change for change in changes if change not in own]
+
+        if args.dry_run:
+            for project_id, user, role, action in changes:
+                writer.row(project_id, user, f"{project_id}_{role}", action, "PLANNED")
+        else:
+            apply_change = functools.partial(apply_group_change, connection)
+            for change, status, error in xnat_cli_scripts.cli_common.ordered_map(apply_change, changes, workers):
+                project_id, user, role, action = change
+                if error is not None:
+                    writer.error([project_id, user, f"{project_id}_{role}", action], xnat_cli_scripts.cli_common.format_error(error))
+                    continue
+                writer.row(project_id, user, f"{project_id}_{role}", action, status)
+
+    print(f"[INFO] {len(reconciled)} projects reconciled: {len(changes)} changes, {len(own)} skipped, {unchanged} memberships already in place", file=sys.stderr)
+
+
+ACCESSIBILITIES = ['private', 'public', 'protected']
+
+
+def fetch_project_accessibility(connection: RestSession, project_id: str) -> str:
+    """ Returns the plain text of /data/projects/{project_id}/accessibility """
+    return connection.get(f"/data/projects/{project_id}/accessibility").text.strip()
+
+
+def fetch_listed_accessibilities(connection: RestSession) -> tuple:
+    """
+    Lists all projects with their accessibility column in one request.
+    Returns ([project_id, ...], {project_id: accessibility}); projects without a
+    recognizable value are left out of the dict, and when the server rejects the
+    column only the project IDs are returned.
+    """
+    from xnat_cli_scripts.cli_session import RestResponseError
+    try:
+        listing = connection.get_json("/data/projects", query={"columns": "ID,project_access"})
+    except RestResponseError:
+        listing = connection.get_json("/data/projects")
+
+    project_ids = []
+    accessibilities = {}
+    for project_json in listing['ResultSet']['Result']:
+        project_id = project_json.get('ID')
+        if not project_id:
+            continue
+        project_ids.append(project_id)
+        accessibility = str(project_json.get('project_access', '')).strip().lower()
+        if accessibility in ACCESSIBILITIES:
+            accessibilities[project_id] = accessibility
+    return project_ids, accessibilities
+
+
+def fetch_accessibilities(connection: RestSession, project_ids: list, workers: int, listed: dict = None) -> tuple:
+    """
+    Reads the current accessibility of every project: from the bulk /data/projects listing
+    (or the already fetched listed values), then with --workers concurrent per-project
+    requests for the projects the listing did not cover.
+    Returns ({project_id: accessibility}, {project_id: error message}).
+    """
+    if listed is None:
+        _, listed = fetch_listed_accessibilities(connection)
+
+    accessibilities = {project_id: listed[project_id] for project_id in project_ids if project_id in listed}
+    errors = {}
+    missing = [project_id for project_id in project_ids if project_id not in listed]
+    fetch_accessibility = functools.partial(fetch_project_accessibility, connection)
+    for project_id, accessibility, error in xnat_cli_scripts.cli_common.ordered_map(fetch_accessibility, missing, workers):
+        if error is not None:
+            errors[project_id] = xnat_cli_scripts.cli_common.format_error(error)
+        else:
+            accessibilities[project_id] = accessibility
+    return accessibilities, errors
+
+
+def execute_list_project_accessibilities(connection: RestSession, args: argparse.Namespace) -> None:
     """
     Lists project accessibilities (private/public/protected).
     Output format: {project}{tab}{accessibility}.
+    Values come from one /data/projects listing where the server includes them.
     """
     project_ids_from_csv = None
 
@@ -293,53 +467,39 @@ def execute_list_project_accessibilities(connection: XNATSession, args: argparse
             print(f"[ERROR] Exception while reading CSV: {e}")
             return
 
-    # Get all projects using `connection`
-    all_projects = connection.get_json("/data/projects")
-    
-    apply_sleep(args)  # Apply sleep after API call
+    project_ids, listed = fetch_listed_accessibilities(connection)
 
-    if 'ResultSet' not in all_projects or 'Result' not in all_projects['ResultSet']:
-        print("[ERROR] Unexpected response format from /data/projects")
-        return
+    # If CSV is used, keep only the projects in the CSV list
+    if project_ids_from_csv:
+        selected = set(project_ids_from_csv)
+        project_ids = [project_id for project_id in project_ids if project_id in selected]
 
-    result = all_projects['ResultSet']['Result']
+    workers = xnat_cli_scripts.cli_common.extract_workers(args)
+    accessibilities, errors = fetch_accessibilities(connection, project_ids, workers, listed)
 
-    for project_json in result:
-        project_id = project_json.get('ID')
-        if not project_id:
-            print(f"[ERROR] Missing 'ID' for project: {project_json}")
-            continue
-
-        # If CSV is used, check if the project is in the CSV list
-        if project_ids_from_csv and project_id not in project_ids_from_csv:
-            continue
-
-        # Use `connection.get()` instead of `requests.get()`
-        accessibility_response = connection.get(f"/data/projects/{project_id}/accessibility")
-
-        apply_sleep(args)  # Apply sleep after each REST call
-
-        if accessibility_response.status_code == 200:
-            accessibility = accessibility_response.text.strip()  # Ensure plain text handling (no JSON parsing)
-        else:
-            print(f"[ERROR] Failed to retrieve accessibility for {project_id}: {accessibility_response.status_code}")
-            accessibility = "Unknown"
+    with xnat_cli_scripts.cli_common.open_row_writer(args, ["Project ID", "Accessibility"]) as writer:
+        for project_id in project_ids:
+            if project_id in errors:
+                print(f"[ERROR] Failed to retrieve accessibility for {project_id}: {errors[project_id]}", file=sys.stderr)
+            writer.row(project_id, accessibilities.get(project_id, "Unknown"))
 
-        # Print the project ID and its accessibility
-        print(f"{project_id}\t{accessibility}")
 
-        apply_sleep(args)  # Sleep after processing each project
+def update_accessibility(connection: RestSession, change: tuple) -> str:
+    project_id, new_accessibility = change
+    connection.put(f"/data/projects/{project_id}/accessibility/{new_accessibility}")
+    return "UPDATED"
 
 
-def execute_update_accessibilities(connection: XNATSession, args: argparse.Namespace) -> None:
+def execute_update_accessibilities(connection: RestSession, args: argparse.Namespace) -> None:
     """
     Update the accessibility of projects based on the CSV file.
     CSV Format: {project_id}{tab}{new_accessibility}
-    The function directly updates the accessibility without checking the current state.
-    Echoes back the original input line and appends "UPDATED" or "ERROR".
+    Current values are read first (concurrently) and only projects that differ are written.
+    Echoes back the original input line and appends "UPDATED", "UNCHANGED" or "ERROR".
     """
 
     if args.csv_file:
+        requested = {}
         try:
             with open(args.csv_file, mode='r') as file:
                 csv_reader = csv.reader(file, delimiter='\t')
@@ -349,30 +509,85 @@ def execute_update_accessibilities(connection: XNATSession, args: argparse.Names
                     
                     project_id, new_accessibility = row[0].strip(), row[1].strip().lower()
 
-                    if new_accessibility not in ['private', 'public', 'protected']:
+                    if new_accessibility not in ACCESSIBILITIES:
                         print(f"[ERROR] Invalid accessibility '{new_accessibility}' for project {project_id}. Skipping.")
                         continue
 
-                    # Directly update the accessibility (no checking of current state)
-                    endpoint = f"/data/projects/{project_id}/accessibility/{new_accessibility}"
-                    response = connection.put(endpoint)
-
-                    apply_sleep(args)  # Sleep after PUT call
-
-                    if response.status_code == 200:
-                        print(f"{project_id}\t{new_accessibility}\tUPDATED")
-                    else:
-                        print(f"{project_id}\t{new_accessibility}\tERROR\t{response.status_code}: {response.text}")
-
-                    apply_sleep(args)  # Sleep after processing each CSV line
+                    # A project listed twice gets the last value, at the position of its first row
+                    requested[project_id] = new_accessibility
 
         except FileNotFoundError:
             print(f"[ERROR] CSV file not found: {args.csv_file}")
+            return
         except Exception as e:
             print(f"[ERROR] Exception while reading CSV: {e}")
+            return
 
+        workers = xnat_cli_scripts.cli_common.extract_workers(args)
+        current, _ = fetch_accessibilities(connection, list(requested), workers)
+
+        # Projects whose current value could not be read are written anyway
+        changes = [(project_id, new_accessibility) for project_id, new_accessibility in requested.items()
+                   if current.get(project_id) != new_accessibility]
+        results = {}
+        update = functools.partial(update_accessibility, connection)
+        for change, status, error in xnat_cli_scripts.cli_common.ordered_map(update, changes, workers):
+            results[change[0]] = (status, error)
+
+        with xnat_cli_scripts.cli_common.open_row_writer(args, ["Project ID", "Accessibility", "Status"]) as writer:
+            for project_id, new_accessibility in requested.items():
+                status, error = results.get(project_id, ("UNCHANGED", None))
+                if error is not None:
+                    writer.error([project_id, new_accessibility], xnat_cli_scripts.cli_common.format_error(error))
+                else:
+                    writer.row(project_id, new_accessibility, status)
+
+
+def format_subject_columns(args: argparse.Namespace) -> list:
+    if (args.brief_format is True):
+        return ["Project ID", "Subject ID", "Subject Label"]
+    return ["Project ID", "Subject ID", "Subject Label", "Insert Date", "Experiment Count"]
 
-def execute_list_master(connection: xnat.session.XNATSession, args: argparse.Namespace) -> None:
+def format_subject_data(subject, experiment_counts, args: argparse.Namespace) -> list:
+    if (args.brief_format is True):
+        return [subject.project, subject.ID, subject.label]
+    return [subject.project, subject.ID, subject.label, subject.insert_date, experiment_counts[subject.ID]]
+
+# Fields of the /data/subjects rows used by the subject listing
+SUBJECT_LISTING_FIELDS = ("ID", "label", "project", "insert_date")
+
+def fetch_subject_experiment_counts(connection: RestSession, project_id: str = None) -> collections.Counter:
+    """ Counts the experiments of every subject (of the archive or of project_id) from one /data/experiments listing """
+    experiments = connection.iter_result_set("/data/experiments", ("subject_ID",), connection.listing_query("ID,subject_ID", project_id))
+    return collections.Counter(row.subject_ID for row in experiments)
+
+def execute_list_subjects(connection: RestSession, args: argparse.Namespace) -> None:
+    # The whole archive costs two requests; --project costs two per listed project
+    project_ids = [None] if args.project_ids is None else [p.strip() for p in args.project_ids.split(",") if p.strip()]
+    with_counts = args.brief_format is not True
+    workers = xnat_cli_scripts.cli_common.extract_workers(args)
+    if with_counts:
+        fetch_counts = functools.partial(fetch_subject_experiment_counts, connection)
+        counted = xnat_cli_scripts.cli_common.ordered_map(fetch_counts, project_ids, workers)
+    else:
+        counted = ((project_id, None, None) for project_id in project_ids)
+
+    with xnat_cli_scripts.cli_common.open_row_writer(args, format_subject_columns(args)) as writer:
+        writer.header()
+        # Counts are fetched concurrently; each subject listing is streamed straight to the output
+        for project_id, experiment_counts, error in counted:
+            if error is None:
+                query = connection.listing_query(",".join(SUBJECT_LISTING_FIELDS), project_id)
+                try:
+                    for subject in connection.iter_result_set("/data/subjects", SUBJECT_LISTING_FIELDS, query):
+                        writer.row(*format_subject_data(subject, experiment_counts, args))
+                except Exception as e:
+                    error = e
+            if error is not None:
+                writer.error([project_id or ""], xnat_cli_scripts.cli_common.format_error(error))
+
+
+def execute_list_master(connection: RestSession, args: argparse.Namespace) -> None:
     # Check for LIST actions first
     if args.users:
         execute_list_project_users(connection, args)
@@ -380,11 +595,13 @@ def execute_list_master(connection: xnat.session.XNATSession, args: argparse.Nam
         execute_list_project_groups(connection, args)
     elif args.accessibilities:
         execute_list_project_accessibilities(connection, args)
+    elif args.subjects:
+        execute_list_subjects(connection, args)
     else:
         execute_list_projects(connection, args)
 
 
-def execute_remove_master(connection: xnat.session.XNATSession, args: argparse.Namespace) -> None:
+def execute_remove_master(connection: RestSession, args: argparse.Namespace) -> None:
     # Check for REMOVE action
     if args.remove and args.groups:
         # If CSV is provided, use it to get groups for removal
@@ -396,7 +613,7 @@ def execute_remove_master(connection: xnat.session.XNATSession, args: argparse.N
         print("[WARNING] Invalid REMOVE action. Use -R with -g and --csv.")
 
 
-def execute_update_master(connection: xnat.session.XNATSession, args: argparse.Namespace) -> None:
+def execute_update_master(connection: RestSession, args: argparse.Namespace) -> None:
     # Check for UPDATE action (Change Groups)
     if args.update and args.groups:
         # If CSV is provided, use it for changing groups
@@ -417,108 +634,58 @@ def execute_update_master(connection: xnat.session.XNATSession, args: argparse.N
         print("[WARNING] Invalid UPDATE action. Use --update with --accessibilities or -g and --csv.")
 
 
-#def execute_project_list(session: xnat.session.XNATSession, args: argparse.Namespace) -> None:
-#
-#    print(format_project_header_rows())
-#    all_projects = session.get_json(f"/data/projects")
-#
-#    result_set = all_projects['ResultSet']
-#    result     = result_set['Result']
-#
-#    for project_json in result:
-#        project_object = session.projects[project_json['ID']]
-#        project_id = project_json['ID']
-#        project_name = project_json['name']
-#        project_pi = f"{project_json['pi_lastname']}, {project_json['pi_firstname']}"
-#        z = session.get_json(f"/data/projects/{project_id}")
-#        print(format_project_data(project_json, project_object))
-
-
-def format_subject_header_rows() -> str:
-    return "Project ID, Project Label, ID, Label, Insert Date, Experiment Count"
-def format_subject_data(p) -> str:
-    return f"{p.id}, {p.label}, {p.insert_date}, {len(p.experiments)} "
-
-def execute_subject_list(session: xnat.session.XNATSession, args: argparse.Namespace) -> None:
-
-    if (args.subjects):
-        print("\nSubject List")
-        print(format_subject_header_rows())
-        for proj in session.projects:
-            project_header = format_project_id_name(session.projects[proj])
-            for subject in session.projects[proj].subjects.values():
-                print(f"{project_header}, {format_subject_data(subject)}")
-                x = ""
-                y = ""
-
-
-
-def format_session_header_rows() -> str:
-    return "Project ID, Project Label, ID, Label, Insert Date, Modality, Scan Count"
-def format_session_data(p) -> str:
-    return f"{p.id}, {p.label}, {p.insert_date}, {p.modality}, {len(p.scans)} "
-
-def execute_session_list(session: xnat.session.XNATSession, args: argparse.Namespace) -> None:
-
-    if (args.sessions):
-        print ("\nSession List")
-        print(format_session_header_rows())
-        for proj in session.projects:
-            po = session.projects[proj]
-            project_header = format_project_id_name(session.projects[proj])
-            for experiment in po.experiments.values():
-                print(f"{project_header} {format_session_data(experiment)}")
-
-
-if __name__ == "__main__":
+def main() -> None:
     parser = argparse.ArgumentParser(description="List projects from an XNAT system")
     parser.add_argument('-x', '--xnat',            dest='url',                      help="URL to XNAT, default is https://cnda.wustl.edu")
     parser.add_argument('-a', '--auth',            dest='auth',                     help="User authentication/login for access to XNAT", required=True)
     parser.add_argument('-p', '--password',        dest='password',                 help="Password for XNAT authentication", required=False)
-    parser.add_argument('-e', '--extension_types', dest='extension_types',          help="True or False for extension_types in xnat.connect")
+    parser.add_argument('-e', '--extension_types', dest='extension_types',          help="Ignored; accepted so existing scripts that pass -e True/False still run")
 
     ## These are operations
     parser.add_argument('-L', '--list',            dest='list',                     help="Action is to LIST",                          action='store_true')
     parser.add_argument('-R', '--remove',          dest='remove',                   help='Remove groups from projects',                action='store_true')
     parser.add_argument(        '--update',        dest='update',                   help='Update project accessibilities',             action='store_true')
+    parser.add_argument(      '--reconcile',       dest='reconcile_file',           help="Bring project groups to the state in this {project}{tab}{user}{tab}{group} file; members of its projects missing from the file are removed, except your own Owners membership")
 
     # These are objects of the operations; 
     parser.add_argument('-u', '--users',           dest='users',                    help='Listing Verb object: Users',                 action='store_true')
     parser.add_argument('-g', '--groups',          dest='groups',                   help='Object: Groups (for both LIST and REMOVE)',  action='store_true')
     parser.add_argument(      '--accessibilities', dest='accessibilities',          help="Accessibilities for projects",                action='store_true')
-    parser.add_argument(      '--subjects',        dest='subjects',                 help="Include list of subjects in output",         action='store_true')
+    parser.add_argument(      '--subjects',        dest='subjects',                 help="Object: Subjects with their experiment counts (LIST)", action='store_true')
     parser.add_argument(      '--sessions',        dest='sessions',                 help="Include list of sessions in output",         action='store_true')
 
-
     ## Further modifiers
+    parser.add_argument(      '--project',         dest='project_ids',              help="Comma separated project IDs that limit --subjects")
     parser.add_argument('-b', '--brief',           dest='brief_format',             help="List in brief format",                       action='store_true')
-    parser.add_argument('-s', '--sleep',           dest='sleep',                    help="Time to sleep after each REST call")
+    parser.add_argument('-s', '--sleep',           dest='sleep',                    help="Deprecated: same as --rate 1/SLEEP")
+    parser.add_argument(      '--dry-run',         dest='dry_run',                  help="With --reconcile, print the planned changes without applying them", action='store_true')
+    parser.add_argument(      '--allow-self-removal', dest='allow_self_removal',    help="With --reconcile, also remove or change your own Owners membership", action='store_true')
     parser.add_argument('-v', '--verbose',         dest='verbose',                  help="Verbose mode",                               action='store_true')
     parser.add_argument('--csv',                   dest='csv_file',                 help='Path to CSV file operations such as listing, removing, or changing groups')
-    
-args = parser.parse_args()
+    xnat_cli_scripts.cli_common.add_session_arguments(parser)
+    xnat_cli_scripts.cli_common.add_output_arguments(parser)
 
-args.url = "https://cnda.wustl.edu" if args.url is None else args.url
+    args = parser.parse_args()
 
-auth_user = xnat_cli_scripts.cli_common.extract_auth_user(args)
-auth_password = xnat_cli_scripts.cli_common.extract_auth_password(args)
-xnat_extensions = xnat_cli_scripts.cli_common.extract_extension_types(args)
+    from xnat_cli_scripts import cli_session
 
-session = xnat.connect(args.url, user=auth_user, password=auth_password, extension_types=xnat_extensions)
+    args.url = "https://cnda.wustl.edu" if args.url is None else args.url
 
-if args.list:
-    execute_list_master(session, args)
-elif args.remove:
-    execute_remove_master(session, args)
-elif args.update:
-    execute_update_master(session, args)
-else:
-    print("[ERROR] No valid action specified. Use -L, -R, or --update.")
+    session = cli_session.connect(args)
 
-#    execute_project_list(session, args)
-#    execute_subject_list(session, args)
-#    execute_session_list(session, args)
+    if args.list:
+        execute_list_master(session, args)
+    elif args.remove:
+        execute_remove_master(session, args)
+    elif args.update:
+        execute_update_master(session, args)
+    elif args.reconcile_file:
+        execute_reconcile_groups(session, args)
+    else:
+        print("[ERROR] No valid action specified. Use -L, -R, --update or --reconcile.")
 
-session.disconnect()
+    session.disconnect()
 
 
+if __name__ == "__main__":
+    main()
@@ -11,130 +11,251 @@ $ python3  [SCOPE]
 ```
 """
 
+from __future__ import annotations
+
 __version__ = (1, 0, 0)
 
 import argparse
+import collections
 import csv
+import functools
+import os
+import threading
 
-import xnat
-import xnat.core
-import xnat.mixin
+from typing import TYPE_CHECKING
 
-def format_project_header_rows() -> str:
-    return "ID, Name, Insert Date, Subject Count, Experiment Count"
-def format_project_data(p) -> str:
-    formatted_string = f"{p.id}, {p.name}, {p.insert_date}, {len(p.subjects)}, {len(p.experiments)}"
-    return formatted_string
+import xnat_cli_scripts.cli_common
 
-def format_project_id_name(p) -> str:
-    return f"{p.id}, {p.name}"
+if TYPE_CHECKING:
+    from xnat_cli_scripts.cli_session import RestSession
 
-def execute_project_list(connection: xnat.session.XNATSession, args: argparse.Namespace) -> None:
+def format_session_header_rows(brief_format_flag) -> list:
+    if brief_format_flag is not None and brief_format_flag is True:
+        return ["Project ID", "Session ID", "Session Label"]
+    else:
+        return ["Project ID", "Session ID", "Session Label", "Insert Date", "Modality", "Scan Count"]
 
-    print(format_project_header_rows())
-    for proj in connection.projects:
-        y = connection.projects[proj]
-        print(format_project_data(y))
 
-def format_subject_header_rows() -> str:
-    return "Project ID, Project Label, ID, Label, Insert Date, Experiment Count"
-def format_subject_data(p) -> str:
-    return f"{p.id}, {p.label}, {p.insert_date}, {len(p.experiments)} "
+def format_session_json(experiment, scan_counts: collections.Counter, brief_format_flag) -> list:
+    if brief_format_flag is not None and brief_format_flag is True:
+        return [experiment.project, experiment.ID, experiment.label]
+    else:
+        return [experiment.project, experiment.ID, experiment.label, experiment.insert_date, experiment.modality, scan_counts[experiment.ID]]
 
-def execute_subject_list(connection: xnat.session.XNATSession, args: argparse.Namespace) -> None:
+# Asking /data/experiments for a scan column joins the scans in: one row per scan
+SCAN_ID_COLUMN = "xnat:imagescandata/id"
 
-    if (args.subjects):
-        print("\nSubject List")
-        print(format_subject_header_rows())
-        for proj in connection.projects:
-            project_header = format_project_id_name(connection.projects[proj])
-            for subject in connection.projects[proj].subjects.values():
-                print(f"{project_header}, {format_subject_data(subject)}")
-                x = ""
-                y = ""
+def fetch_scan_counts(connection: RestSession, project_id: str = None) -> collections.Counter:
+    """
+    Counts the scans of every experiment (optionally of one project) from one joined
+    experiment/scan listing, instead of listing the scans of each experiment.
+    Experiments without scans come back with an empty scan ID and count zero.
+    """
+    query = connection.listing_query(f"ID,{SCAN_ID_COLUMN}", project_id)
+    scan_counts = collections.Counter()
+    for experiment_id, scan_id in connection.iter_result_set("/data/experiments", ("ID", SCAN_ID_COLUMN), query):
+        if scan_id:
+            scan_counts[experiment_id] += 1
+    return scan_counts
 
+def fetch_project_sessions(connection: RestSession, brief_format_flag, project_id: str) -> tuple:
+    """
+    Resolves the sessions of one project with a single listing (scan-joined unless brief).
+    Returns ({experiment ID or label: experiment row}, scan counts by experiment ID).
+    """
+    fields = ("ID", "label", "project") if brief_format_flag is True else ("ID", "label", "project", "insert_date", "modality", SCAN_ID_COLUMN)
+    query = connection.listing_query(",".join(fields), project_id)
+    experiments_by_key = {}
+    scan_counts = collections.Counter()
+    for experiment in connection.iter_result_set("/data/experiments", fields, query):
+        experiments_by_key.setdefault(experiment.ID, experiment)
+        experiments_by_key.setdefault(experiment.label, experiment)
+        if brief_format_flag is not True and experiment[-1]:
+            scan_counts[experiment.ID] += 1
+    return experiments_by_key, scan_counts
 
+def execute_selected_session_list(connection: RestSession, args: argparse.Namespace, writer) -> None:
+    with open(args.csv_file, newline='') as csvfile:
+        rows = [row for row in csv.reader(csvfile, delimiter='\t') if len(row) >= 2]
 
-def format_session_header_rows(brief_format_flag) -> str:
-    if brief_format_flag is not None and brief_format_flag is True:
-        return "Project ID\tSession ID\tSession Label"
-    else:
-        return "Project ID\tSession ID\tSession Label\tInsert Date\tModality\tScan Count"
+    # Rows are grouped by project: one listing per project is joined to them in memory, in CSV order
+    workers = xnat_cli_scripts.cli_common.extract_workers(args)
+    project_ids = sorted({row[0] for row in rows})
+    fetch_sessions = functools.partial(fetch_project_sessions, connection, args.brief_format)
+    listings = {}
+    listing_errors = {}
+    for project_id, listing, error in xnat_cli_scripts.cli_common.ordered_map(fetch_sessions, project_ids, workers):
+        if error is not None:
+            listing_errors[project_id] = f"Listing experiments failed: {xnat_cli_scripts.cli_common.format_error(error)}"
+        else:
+            listings[project_id] = listing
 
+    for row in rows:
+        if row[0] in listing_errors:
+            writer.error(row[:2], listing_errors[row[0]])
+            continue
+        experiments_by_key, scan_counts = listings[row[0]]
+        experiment = experiments_by_key.get(row[1])
+        if experiment is None:
+            writer.error(row[:2], "Not found in the project's experiments", status="MISSING")
+            continue
+        writer.row(*format_session_json(experiment._replace(project=row[0]), scan_counts, args.brief_format))
 
-def format_session_data(project_id, p, brief_format_flag) -> str:
-    if brief_format_flag is not None and brief_format_flag is True:
-        return f"{project_id}\t{p.id}\t{p.label}\t "
-    else:
-        return f"{project_id}\t{p.id}\t{p.label}\t{p.insert_date}\t{p.modality}\t{len(p.scans)} "
-
-def execute_session_list(connection: xnat.session.XNATSession, args: argparse.Namespace) -> None:
-
-    if (args.csv_file is None):
-        print ("\nSession List")
-        print(format_session_header_rows(args.brief_format))
-        for proj in connection.projects:
-            if (args.project_id is None or args.project_id == proj):
-                po = connection.projects[proj]
-                for experiment_obj in po.experiments.values():
-                    print(format_session_data(proj, experiment_obj, args.brief_format))
-    else:
-        print("\nSelected Sessions")
-        print(format_session_header_rows(args.brief_format))
-        with open(args.csv_file, newline='') as csvfile:
-            rdr = csv.reader(csvfile, delimiter='\t')
-            for row in rdr:
-                experiment_obj = connection.create_object(f"/data/projects/{row[0]}/experiments/{row[1]}")
-                print(format_session_data(row[0], experiment_obj, args.brief_format))
-#                print(f"{row[0]}\t{row[1]}\t{experiment_obj}\t{experiment_obj.id}")
-
-def execute_session_delete(connection: xnat.session.XNATSession, args: argparse.Namespace) -> None:
-
-    print("\nDelete Sessions")
-    with open(args.csv_file, newline='') as csvfile:
-        rdr = csv.reader(csvfile, delimiter='\t')
-        for row in rdr:
-            experiment_obj = connection.create_object(f"/data/projects/{row[0]}/experiments/{row[1]}")
-            print(f"{row[0]}\t{row[1]}\t{experiment_obj}")
-            experiment_obj.delete(remove_files=True)
+def execute_session_list(connection: RestSession, args: argparse.Namespace) -> None:
+
+    with xnat_cli_scripts.cli_common.open_row_writer(args, format_session_header_rows(args.brief_format)) as writer:
+        if (args.csv_file is None):
+            writer.title("\nSession List")
+            writer.header()
+            # One experiment listing (plus one scan join for the counts) covers the whole archive or --project
+            scan_counts = None
+            fields = ("ID", "label", "project")
+            if (args.brief_format is not True):
+                scan_counts = fetch_scan_counts(connection, args.project_id)
+                fields += ("insert_date", "modality")
+            query = connection.listing_query(",".join(fields), args.project_id)
+            for experiment in connection.iter_result_set("/data/experiments", fields, query):
+                writer.row(*format_session_json(experiment, scan_counts, args.brief_format))
+        else:
+            writer.title("\nSelected Sessions")
+            writer.header()
+            execute_selected_session_list(connection, args, writer)
+
+def read_delete_journal(journal_file: str) -> set:
+    """ Returns the (project, experiment) pairs a previous run recorded as DELETED """
+    completed = set()
+    if not os.path.exists(journal_file):
+        return completed
+
+    with open(journal_file, newline='') as journal:
+        for row in csv.reader(journal, delimiter='\t'):
+            if len(row) >= 3 and row[2] == "DELETED":
+                completed.add((row[0], row[1]))
+    return completed
+
+def write_journal(journal, journal_lock: threading.Lock, *fields: str) -> None:
+    """ Appends one tab separated outcome line to the delete journal and flushes it """
+    with journal_lock:
+        journal.write("\t".join(fields) + "\n")
+        journal.flush()
+
+def delete_session(connection: RestSession, journal, journal_lock: threading.Lock, completed: set, row: list) -> tuple:
+    """
+    Deletes one experiment (and its files) with a single DELETE; no GET of the object first.
+    Returns (status, message). The outcome is appended to the journal as soon as the call
+    returns so an interrupted run can be resumed without repeating completed rows.
+    """
+    if len(row) < 2:
+        write_journal(journal, journal_lock, *(row + [""])[:2], "SKIPPED", "Invalid row format")
+        return "SKIPPED", "Invalid row format"
 
-def execute_session_rename(connection: xnat.session.XNATSession, args: argparse.Namespace) -> None:
+    project_id, experiment_id = row[0], row[1]
+    if (project_id, experiment_id) in completed:
+        write_journal(journal, journal_lock, project_id, experiment_id, "SKIPPED", "Deleted by a previous run")
+        return "SKIPPED", "Deleted by a previous run"
+
+    try:
+        connection.delete(f"/data/projects/{project_id}/experiments/{experiment_id}", query={"removeFiles": "true"})
+    except Exception as e:
+        write_journal(journal, journal_lock, project_id, experiment_id, "ERROR", xnat_cli_scripts.cli_common.format_error(e))
+        raise
+
+    write_journal(journal, journal_lock, project_id, experiment_id, "DELETED")
+    return "DELETED", ""
+
+def execute_session_delete(connection: RestSession, args: argparse.Namespace) -> None:
+    journal_file = args.journal_file if args.journal_file is not None else f"{args.csv_file}.journal"
+    completed = read_delete_journal(journal_file) if args.resume else set()
+
+    columns = ["Project ID", "Session ID", "Status", "Message"]
+    with open(args.csv_file, newline='') as csvfile, \
+         open(journal_file, 'a', newline='') as journal, \
+         xnat_cli_scripts.cli_common.open_row_writer(args, columns) as writer:
+        writer.title("\nDelete Sessions")
+
+        rows = (row for row in csv.reader(csvfile, delimiter='\t') if row)
+        delete_row = functools.partial(delete_session, connection, journal, threading.Lock(), completed)
+        workers = xnat_cli_scripts.cli_common.extract_workers(args)
+        for row, result, error in xnat_cli_scripts.cli_common.ordered_map(delete_row, rows, workers):
+            if error is not None:
+                writer.error(row[:2], xnat_cli_scripts.cli_common.format_error(error))
+            else:
+                writer.row(*row[:2], *result)
+
+def fetch_project_experiments(connection: RestSession, columns: str, project_id: str) -> list:
+    """ Returns the ResultSet rows of one experiment listing of project_id with the given columns """
+    experiments = connection.get_json(f"/data/projects/{project_id}/experiments", query={"columns": columns})
+    return experiments['ResultSet']['Result']
+
+def rename_session(connection: RestSession, experiments_by_key: dict, listing_errors: dict, row: list) -> tuple:
+    """ Issues the label PUT for one CSV row; returns (status, message) """
+    if len(row) < 3:
+        return "SKIPPED", "Invalid row format"
+    if row[0] in listing_errors:
+        return "ERROR", listing_errors[row[0]]
+
+    experiment_json = experiments_by_key.get((row[0], row[1]))
+    if experiment_json is None:
+        return "MISSING", ""
+
+    query_arguments = {"label": row[2]}
+    url_path=f"/REST/projects/{row[0]}/subjects/{experiment_json['subject_ID']}/experiments/{experiment_json['ID']}"
+    connection.put(url_path, query=query_arguments)
+    return "RENAMED", url_path
+
+def execute_session_rename(connection: RestSession, args: argparse.Namespace) -> None:
 
-    print("\nRename Sessions")
     with open(args.csv_file, newline='') as csvfile:
-        rdr = csv.reader(csvfile, delimiter='\t')
-        for row in rdr:
-            experiment_obj = connection.create_object(f"/data/projects/{row[0]}/experiments/{row[1]}")
-            subject_id = experiment_obj.subject_id
-            experiment_id = experiment_obj.id
-            query_arguments = {"label": row[2]}
-            print(f"{row[0]}\t{row[1]}\t{row[2]}\t{experiment_obj} {query_arguments}")
-            url_path=f"/REST/projects/{row[0]}/subjects/{subject_id}/experiments/{experiment_id}"
-            print(f"{url_path} {query_arguments}")
-            connection.put(url_path, query=query_arguments)
+        rows = [row for row in csv.reader(csvfile, delimiter='\t') if row]
 
-if __name__ == "__main__":
+    # One experiment listing per project resolves subject and experiment IDs for all of its rows
+    workers = xnat_cli_scripts.cli_common.extract_workers(args)
+    project_ids = sorted({row[0] for row in rows if len(row) >= 3})
+    fetch_experiments = functools.partial(fetch_project_experiments, connection, "ID,label,subject_ID")
+    experiments_by_key = {}
+    listing_errors = {}
+    for project_id, experiments, error in xnat_cli_scripts.cli_common.ordered_map(fetch_experiments, project_ids, workers):
+        if error is not None:
+            listing_errors[project_id] = f"Listing experiments failed: {xnat_cli_scripts.cli_common.format_error(error)}"
+            continue
+        for experiment_json in experiments:
+            experiments_by_key[(project_id, experiment_json['ID'])] = experiment_json
+            experiments_by_key[(project_id, experiment_json['label'])] = experiment_json
+
+    columns = ["Project ID", "Session", "New Label", "Status", "Message"]
+    with xnat_cli_scripts.cli_common.open_row_writer(args, columns) as writer:
+        writer.title("\nRename Sessions")
+        rename_row = functools.partial(rename_session, connection, experiments_by_key, listing_errors)
+        for row, result, error in xnat_cli_scripts.cli_common.ordered_map(rename_row, rows, workers):
+            if error is not None:
+                writer.error(row[:3], xnat_cli_scripts.cli_common.format_error(error))
+            else:
+                writer.row(*row[:3], *result)
+
+
+def main() -> None:
     parser = argparse.ArgumentParser(description="List projects from an XNAT system")
     parser.add_argument('-x', '--xnat',            dest='url',             help="URL to XNAT, default is https://cnda.wustl.edu")
     parser.add_argument('-u', '--user',            dest='user',            help="User login for access to XNAT", required=True)
-    parser.add_argument('-e', '--extension_types', dest='extension_types', help="True or False for extension_types in xnat.connect")
+    parser.add_argument('-e', '--extension_types', dest='extension_types', help="Ignored; accepted so existing scripts that pass -e True/False still run")
     parser.add_argument('-c', '--csv_file',        dest='csv_file',        help="CSV file with list of sessions for operations")
     parser.add_argument('-l', '--list',            dest='list_sessions',   help="Action is to LIST sessions",    action='store_true')
     parser.add_argument('-b', '--brief',           dest='brief_format',    help="List in brief format",          action='store_true')
     parser.add_argument('-p', '--project',         dest='project_id',      help="Optional Project ID used in list process")
     parser.add_argument('-d', '--delete',          dest='delete_sessions', help="Action is to DELETE sessions",  action='store_true')
     parser.add_argument('-r', '--rename',          dest='rename_sessions', help="Action is to RENAME sessions",  action='store_true')
+    parser.add_argument(      '--journal',         dest='journal_file',    help="Per-row result journal for --delete (default: CSV_FILE.journal)")
+    parser.add_argument(      '--resume',          dest='resume',          help="Skip rows the --delete journal records as DELETED", action='store_true')
+    xnat_cli_scripts.cli_common.add_session_arguments(parser)
+    xnat_cli_scripts.cli_common.add_output_arguments(parser)
 
     args = parser.parse_args()
 
+    from xnat_cli_scripts import cli_session
+
     args.url = "https://cnda.wustl.edu" if args.url is None else args.url
-    args.extension_types = False if args.extension_types is None else args.extension_types
 
-    password = None
-#    password="admin"
-    print(f"args.extension_types: {args.extension_types}")
-    args.extension_types = "True" if args.extension_types is None else args.extension_types
-    connection = xnat.connect(args.url, user=args.user, password=password, extension_types=False)
+    connection = cli_session.connect(args)
 
     if args.list_sessions:
         execute_session_list(connection, args)
@@ -147,3 +268,6 @@ if __name__ == "__main__":
 
     connection.disconnect()
 
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,373 @@
+#!/bin/python3
+"""
+snapshot.py
+---
+--------------------------------------------------------------------------------
+Crawls the projects, their accessibility, the project memberships and the user
+groups of an XNAT once into an indexed SQLite file, then answers audit
+questions from that file without touching the server.
+Running create again on an existing file refreshes it incrementally: project
+member listings are revalidated with their ETag and user groups are fetched
+again only for users whose memberships changed.
+
+Example usage of the CLI:
+```bash
+$ python3 -m xnat_cli_scripts.snapshot create -a admin -x https://xnat.example.org -o archive.sqlite -w 8
+$ python3 -m xnat_cli_scripts.snapshot query archive.sqlite single-user-groups
+$ python3 -m xnat_cli_scripts.snapshot query archive.sqlite inactive-project-users --inactive inactive_projects.txt
+$ python3 -m xnat_cli_scripts.snapshot query archive.sqlite --sql "SELECT role, COUNT(*) FROM memberships GROUP BY role"
+$ python3 -m xnat_cli_scripts.snapshot diff last_week.sqlite archive.sqlite
+```
+"""
+
+from __future__ import annotations
+
+__version__ = (1, 0, 0)
+
+import argparse
+import datetime
+import functools
+import os
+import sqlite3
+import sys
+from typing import TYPE_CHECKING, Union
+
+import xnat_cli_scripts.cli_common
+import xnat_cli_scripts.projects
+import xnat_cli_scripts.users
+
+if TYPE_CHECKING:
+    from xnat_cli_scripts.cli_session import RestSession
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (
+    key           TEXT PRIMARY KEY,
+    value         TEXT
+);
+CREATE TABLE IF NOT EXISTS projects (
+    id            TEXT PRIMARY KEY,
+    accessibility TEXT,
+    users_etag    TEXT
+);
+CREATE TABLE IF NOT EXISTS memberships (
+    project       TEXT NOT NULL,
+    login         TEXT NOT NULL,
+    group_id      TEXT NOT NULL,
+    role          TEXT NOT NULL,
+    displayname   TEXT,
+    PRIMARY KEY (project, login)
+);
+CREATE INDEX IF NOT EXISTS memberships_login ON memberships (login);
+CREATE INDEX IF NOT EXISTS memberships_group ON memberships (group_id);
+CREATE TABLE IF NOT EXISTS users (
+    login         TEXT PRIMARY KEY,
+    groups_error  TEXT
+);
+CREATE TABLE IF NOT EXISTS user_groups (
+    login         TEXT NOT NULL,
+    group_id      TEXT NOT NULL,
+    PRIMARY KEY (login, group_id)
+);
+CREATE INDEX IF NOT EXISTS user_groups_group ON user_groups (group_id);
+"""
+
+# Canned audit questions: name -> (output columns, SQL)
+QUERIES = {
+    "single-user-groups": (
+        ["Group ID", "Project", "Login"],
+        """SELECT group_id, project, MIN(login) FROM memberships
+           GROUP BY group_id HAVING COUNT(*) = 1 ORDER BY group_id"""),
+    "inactive-project-users": (
+        ["Project", "Login", "Group ID"],
+        """SELECT m.project, m.login, m.group_id FROM memberships m
+           JOIN inactive_projects i ON i.project = m.project ORDER BY m.project, m.login"""),
+    "owners-without-members": (
+        ["Project", "Owners"],
+        """SELECT project, GROUP_CONCAT(login, ',') FROM memberships
+           GROUP BY project HAVING SUM(role = 'owner') > 0 AND SUM(role <> 'owner') = 0 ORDER BY project"""),
+}
+
+# Differences between two snapshots: (change, SQL over main = old and new = new)
+DIFF_QUERIES = [
+    ("PROJECT_ADDED",         """SELECT id, '', '', accessibility FROM new.projects
+                                 WHERE id NOT IN (SELECT id FROM main.projects)"""),
+    ("PROJECT_REMOVED",       """SELECT id, '', accessibility, '' FROM main.projects
+                                 WHERE id NOT IN (SELECT id FROM new.projects)"""),
+    ("ACCESSIBILITY_CHANGED", """SELECT o.id, '', o.accessibility, n.accessibility FROM main.projects o
+                                 JOIN new.projects n ON n.id = o.id WHERE o.accessibility IS NOT n.accessibility"""),
+    ("MEMBER_ADDED",          """SELECT n.project, n.login, '', n.group_id FROM new.memberships n
+                                 LEFT JOIN main.memberships o ON o.project = n.project AND o.login = n.login
+                                 WHERE o.login IS NULL"""),
+    ("MEMBER_REMOVED",        """SELECT o.project, o.login, o.group_id, '' FROM main.memberships o
+                                 LEFT JOIN new.memberships n ON n.project = o.project AND n.login = o.login
+                                 WHERE n.login IS NULL"""),
+    ("GROUP_CHANGED",         """SELECT o.project, o.login, o.group_id, n.group_id FROM main.memberships o
+                                 JOIN new.memberships n ON n.project = o.project AND n.login = o.login
+                                 WHERE o.group_id <> n.group_id"""),
+    ("USER_GROUP_ADDED",      """SELECT '', n.login, '', n.group_id FROM new.user_groups n
+                                 LEFT JOIN main.user_groups o ON o.login = n.login AND o.group_id = n.group_id
+                                 WHERE o.login IS NULL AND n.login IN (SELECT login FROM compared_users)"""),
+    ("USER_GROUP_REMOVED",    """SELECT '', o.login, o.group_id, '' FROM main.user_groups o
+                                 LEFT JOIN new.user_groups n ON n.login = o.login AND n.group_id = o.group_id
+                                 WHERE n.login IS NULL AND o.login IN (SELECT login FROM compared_users)"""),
+]
+
+# User groups are only compared for users whose groups were fetched into both snapshots
+COMPARED_USERS = """CREATE TEMP VIEW compared_users AS
+                    SELECT login FROM main.users WHERE groups_error IS NULL
+                    INTERSECT SELECT login FROM new.users WHERE groups_error IS NULL"""
+
+
+def open_snapshot(snapshot_file: str, create: bool = False) -> sqlite3.Connection:
+    """ Opens (with create, creating) the snapshot file and makes sure the schema exists """
+    if not create and not os.path.isfile(snapshot_file):
+        raise FileNotFoundError(f"Snapshot file not found: {snapshot_file}")
+    db = sqlite3.connect(snapshot_file)
+    db.executescript(SCHEMA)
+    return db
+
+
+def fetch_project_members(connection: RestSession, etags: dict, project_id: str) -> Union[tuple, None]:
+    """
+    Lists the members of one project, revalidating the previous listing with its ETag.
+    Returns None when the server answers 304 Not Modified, else (etag, [(login, group_id, displayname), ...]).
+    """
+    etag = etags.get(project_id)
+    response = connection.get(f"/data/projects/{project_id}/users", format="json", accepted_status=(200, 304),
+                              headers={"If-None-Match": etag} if etag else None)
+    if response.status_code == 304:
+        return None
+    members = [(row['login'], row['GROUP_ID'], row.get('displayname', ''))
+               for row in response.json()['ResultSet']['Result']]
+    return response.headers.get("ETag"), members
+
+
+def refresh_projects(connection: RestSession, db: sqlite3.Connection, full: bool, workers: int) -> tuple:
+    """
+    Brings the projects and memberships tables up to date.
+    Returns (logins whose memberships changed, number of projects refetched, errors).
+    """
+    project_ids, listed = xnat_cli_scripts.projects.fetch_listed_accessibilities(connection)
+    accessibilities, errors = xnat_cli_scripts.projects.fetch_accessibilities(connection, project_ids, workers, listed)
+    for project_id, message in errors.items():
+        print(f"[ERROR] Accessibility of {project_id}: {message}", file=sys.stderr)
+
+    known = {project_id: etag for project_id, etag in db.execute("SELECT id, users_etag FROM projects")}
+    changed_logins = set()
+
+    # Projects gone from the server take their memberships with them
+    for project_id in set(known) - set(project_ids):
+        changed_logins.update(login for (login,) in db.execute("SELECT login FROM memberships WHERE project = ?", (project_id,)))
+        db.execute("DELETE FROM memberships WHERE project = ?", (project_id,))
+        db.execute("DELETE FROM projects WHERE id = ?", (project_id,))
+
+    etags = {} if full else known
+    fetch_members = functools.partial(fetch_project_members, connection, etags)
+    refetched = 0
+    failed = len(errors)
+    for project_id, listing, error in xnat_cli_scripts.cli_common.ordered_map(fetch_members, project_ids, workers):
+        db.execute("INSERT INTO projects (id, accessibility) VALUES (?, ?) "
+                   "ON CONFLICT (id) DO UPDATE SET accessibility = COALESCE(excluded.accessibility, accessibility)",
+                   (project_id, accessibilities.get(project_id)))
+        if error is not None:
+            # The previous memberships stay; the ETag is dropped so the next run lists them again
+            print(f"[ERROR] Members of {project_id}: {xnat_cli_scripts.cli_common.format_error(error)}", file=sys.stderr)
+            db.execute("UPDATE projects SET users_etag = NULL WHERE id = ?", (project_id,))
+            failed += 1
+            continue
+        if listing is None:
+            continue
+
+        etag, members = listing
+        refetched += 1
+        old = {login: group_id for login, group_id in
+               db.execute("SELECT login, group_id FROM memberships WHERE project = ?", (project_id,))}
+        new = {login: group_id for login, group_id, _ in members}
+        changed_logins.update(login for login in old.keys() | new.keys() if old.get(login) != new.get(login))
+
+        db.execute("DELETE FROM memberships WHERE project = ?", (project_id,))
+        db.executemany("INSERT OR REPLACE INTO memberships (project, login, group_id, role, displayname) VALUES (?, ?, ?, ?, ?)",
+                       [(project_id, login, group_id, xnat_cli_scripts.projects.normalize_group(project_id, group_id), displayname)
+                        for login, group_id, displayname in members])
+        db.execute("UPDATE projects SET users_etag = ? WHERE id = ?", (etag, project_id))
+
+    return changed_logins, refetched, failed
+
+
+def refresh_user_groups(connection: RestSession, db: sqlite3.Connection, changed_logins: set, full: bool, workers: int) -> tuple:
+    """
+    Fetches /xapi/users/{login}/groups for the members whose memberships changed, who are
+    new, or whose last fetch failed (every member with full) and drops users that left.
+    Returns (number of users fetched, errors).
+    """
+    members = {login for (login,) in db.execute("SELECT DISTINCT login FROM memberships")}
+    current = {login: groups_error for login, groups_error in db.execute("SELECT login, groups_error FROM users")}
+
+    for login in set(current) - members:
+        db.execute("DELETE FROM user_groups WHERE login = ?", (login,))
+        db.execute("DELETE FROM users WHERE login = ?", (login,))
+
+    if full:
+        logins = sorted(members)
+    else:
+        logins = sorted(login for login in members
+                        if login in changed_logins or login not in current or current[login] is not None)
+
+    fetch_groups = functools.partial(xnat_cli_scripts.users.fetch_user_groups, connection)
+    failed = 0
+    for login, groups, error in xnat_cli_scripts.cli_common.ordered_map(fetch_groups, logins, workers):
+        if error is not None:
+            message = xnat_cli_scripts.cli_common.format_error(error)
+            print(f"[ERROR] Groups of {login}: {message}", file=sys.stderr)
+            db.execute("INSERT OR REPLACE INTO users (login, groups_error) VALUES (?, ?)", (login, message))
+            failed += 1
+            continue
+        db.execute("DELETE FROM user_groups WHERE login = ?", (login,))
+        db.executemany("INSERT OR IGNORE INTO user_groups (login, group_id) VALUES (?, ?)", [(login, group_id) for group_id in groups])
+        db.execute("INSERT OR REPLACE INTO users (login, groups_error) VALUES (?, NULL)", (login,))
+    return len(logins), failed
+
+
+def execute_create(args: argparse.Namespace) -> int:
+    from xnat_cli_scripts import cli_session
+
+    full = args.full or not os.path.isfile(args.snapshot_file)
+    db = open_snapshot(args.snapshot_file, create=True)
+    connection = cli_session.connect(args)
+    workers = xnat_cli_scripts.cli_common.extract_workers(args)
+    try:
+        # One transaction: an interrupted crawl leaves the previous snapshot as it was
+        with db:
+            server = db.execute("SELECT value FROM meta WHERE key = 'server'").fetchone()
+            if server is not None and server[0] != args.url:
+                print(f"[ERROR] {args.snapshot_file} is a snapshot of {server[0]}, not {args.url}")
+                return 1
+
+            changed_logins, refetched, project_errors = refresh_projects(connection, db, full, workers)
+            fetched_users, user_errors = 0, 0
+            if not args.skip_user_groups:
+                fetched_users, user_errors = refresh_user_groups(connection, db, changed_logins, full, workers)
+            else:
+                # Their user_groups rows are stale; the next run that fetches groups refreshes them
+                db.executemany("UPDATE users SET groups_error = 'not refreshed' WHERE login = ? AND groups_error IS NULL",
+                               [(login,) for login in sorted(changed_logins)])
+
+            now = datetime.datetime.now().isoformat(timespec="seconds")
+            db.executemany("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)",
+                           [("server", args.url), ("refreshed", now)] + ([("created", now)] if full and server is None else []))
+    except cli_session.RestResponseError as e:
+        # A failed login or /data/projects listing; the transaction leaves the snapshot as it was
+        print(f"[ERROR] {xnat_cli_scripts.cli_common.format_error(e)}")
+        return 1
+    finally:
+        connection.disconnect()
+
+    projects, memberships, users = (db.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+                                    for table in ("projects", "memberships", "users"))
+    db.close()
+    print(f"{args.snapshot_file}: {projects} projects ({refetched} listed again), {memberships} memberships, "
+          f"{users} users ({fetched_users} groups fetched), {project_errors + user_errors} errors")
+    return 1 if project_errors + user_errors else 0
+
+
+def read_inactive_projects(inactive_file: str) -> list:
+    """ Project IDs in the first column of a tab separated file, one per line """
+    with open(inactive_file, mode='r') as file:
+        return [line.split("\t")[0].strip() for line in file if line.strip()]
+
+
+def execute_query(args: argparse.Namespace) -> int:
+    if (args.sql is None) == (args.query_name is None):
+        print("[ERROR] Name one canned query or give --sql")
+        return 1
+    if args.query_name == "inactive-project-users" and args.inactive_file is None:
+        print("[ERROR] inactive-project-users needs --inactive with the inactive project IDs")
+        return 1
+
+    db = open_snapshot(args.snapshot_file)
+    db.execute("CREATE TEMP TABLE inactive_projects (project TEXT PRIMARY KEY)")
+    if args.inactive_file is not None:
+        db.executemany("INSERT OR IGNORE INTO inactive_projects (project) VALUES (?)",
+                       [(project_id,) for project_id in read_inactive_projects(args.inactive_file)])
+
+    if args.sql is not None:
+        cursor = db.execute(args.sql)
+        columns = [description[0] for description in cursor.description or []]
+    else:
+        columns, sql = QUERIES[args.query_name]
+        cursor = db.execute(sql)
+
+    with xnat_cli_scripts.cli_common.open_row_writer(args, columns) as writer:
+        writer.header()
+        for row in cursor:
+            writer.row(*("" if value is None else value for value in row))
+    db.close()
+    return 0
+
+
+def execute_diff(args: argparse.Namespace) -> int:
+    db = open_snapshot(args.old_file)
+    open_snapshot(args.new_file).close()
+    db.execute("ATTACH DATABASE ? AS new", (args.new_file,))
+    db.execute(COMPARED_USERS)
+
+    changes = 0
+    with xnat_cli_scripts.cli_common.open_row_writer(args, ["Change", "Project", "User", "Old", "New"]) as writer:
+        writer.header()
+        for change, sql in DIFF_QUERIES:
+            for row in db.execute(sql + " ORDER BY 1, 2"):
+                writer.row(change, *("" if value is None else value for value in row))
+                changes += 1
+    db.close()
+    return 1 if changes else 0
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Snapshot the project/user/group graph of an XNAT into SQLite and query it")
+    commands = parser.add_subparsers(dest='command', metavar='{create,query,diff}')
+
+    output = argparse.ArgumentParser(add_help=False)
+    xnat_cli_scripts.cli_common.add_output_arguments(output)
+
+    create = commands.add_parser('create', help="Crawl the server into a new snapshot or refresh an existing one")
+    create.add_argument('-x', '--xnat',            dest='url',             help="URL to XNAT, default is https://cnda.wustl.edu")
+    create.add_argument('-a', '--auth',            dest='auth',            help="User authentication/login for access to XNAT", required=True)
+    create.add_argument('-p', '--password',        dest='password',        help="Password for XNAT authentication")
+    create.add_argument('-e', '--extension_types', dest='extension_types', help="Ignored; accepted so existing scripts that pass -e True/False still run")
+    create.add_argument('-o', '--snapshot',        dest='snapshot_file',   help="SQLite snapshot file to create or refresh", required=True)
+    create.add_argument(      '--full',            dest='full',            help="Refetch every listing instead of refreshing incrementally", action='store_true')
+    create.add_argument(      '--skip-user-groups', dest='skip_user_groups', help="Do not fetch /xapi/users/{user}/groups", action='store_true')
+    xnat_cli_scripts.cli_common.add_session_arguments(create, cache=False)
+
+    query = commands.add_parser('query', parents=[output], help="Answer a canned audit question or --sql from a snapshot")
+    query.add_argument('snapshot_file',                                    help="SQLite snapshot file")
+    query.add_argument('query_name',               nargs='?',              help="Canned query", choices=list(QUERIES))
+    query.add_argument(      '--sql',              dest='sql',             help="SQL over the projects, memberships, users and user_groups tables")
+    query.add_argument(      '--inactive',         dest='inactive_file',   help="File of inactive project IDs (first column) for inactive-project-users")
+
+    diff = commands.add_parser('diff', parents=[output], help="List what changed between two snapshots (exit status 1 when anything did)")
+    diff.add_argument('old_file',                                          help="Older SQLite snapshot file")
+    diff.add_argument('new_file',                                          help="Newer SQLite snapshot file")
+
+    args = parser.parse_args()
+
+    try:
+        if args.command == 'create':
+            args.url = "https://cnda.wustl.edu" if args.url is None else args.url
+            status = execute_create(args)
+        elif args.command == 'query':
+            status = execute_query(args)
+        elif args.command == 'diff':
+            status = execute_diff(args)
+        else:
+            parser.print_usage()
+            status = 2
+    except (OSError, sqlite3.Error) as e:
+        print(f"[ERROR] {xnat_cli_scripts.cli_common.format_error(e)}")
+        status = 1
+    sys.exit(status)
+
+
+if __name__ == "__main__":
+    main()
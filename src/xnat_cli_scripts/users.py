@@ -11,53 +11,87 @@ $ python3  [SCOPE]
 ```
 """
 
+from __future__ import annotations
+
 __version__ = (1, 0, 0)
 
 import argparse
 import csv
-from time import sleep
+import functools
+import sys
+from typing import TYPE_CHECKING, Iterator, Tuple
 
-import xnat
-import xnat.core
-import xnat.mixin
 import xnat_cli_scripts.cli_common
 
-def execute_list_user_projects(connection: xnat.session.XNATSession, args: argparse.Namespace) -> None:
-    target_user = args.target_user
-    user_groups = connection.get_json(f"/xapi/users/{target_user}/groups")
-    index = 1
-    group_length = len(user_groups)
-    float_sleep = 0.0
-    if (args.sleep is not None):
-        float_sleep = float(args.sleep)
-
-    tab = "\t"
-    for x_group in user_groups:
-        role_index = x_group.rindex("_")
-        project_only = x_group[:role_index]
-        if args.verbose:
-            print(f"{index}{tab}{group_length}{tab}{target_user}{tab}{project_only}")
-            index += 1
-        else:
-            print(f"{target_user}{tab}{project_only}")
-
-        sleep(float_sleep)
-
-def execute_list_user_groups(connection: xnat.session.XNATSession, args: argparse.Namespace) -> None:
-    target_user = args.target_user
-    user_groups = connection.get_json(f"/xapi/users/{target_user}/groups")
-    index = 1
-    group_length = len(user_groups)
-
-    tab = "\t"
-    for x_group in user_groups:
-        if args.verbose:
-            print(f"{index}{tab}{target_user}{tab}{x_group}")
-            index += 1
-        else:
-            print(f"{target_user}{tab}{x_group}")
-
-def execute_list_master(connection: xnat.session.XNATSession, args: argparse.Namespace) -> None:
+if TYPE_CHECKING:
+    from xnat_cli_scripts.cli_session import RestSession
+
+def read_user_list(list_file: str) -> list:
+    """ Returns the user logins in the first column of a tab separated file ('-' reads stdin), without repeats """
+    users = []
+    infile = sys.stdin if list_file == "-" else open(list_file, newline='')
+    try:
+        for row in csv.reader(infile, delimiter='\t'):
+            if row and row[0].strip() and row[0].strip() not in users:
+                users.append(row[0].strip())
+    finally:
+        if infile is not sys.stdin:
+            infile.close()
+    return users
+
+def extract_target_users(args: argparse.Namespace) -> list:
+    """ Users named by --csv (a file or '-') when given, otherwise the comma separated --target_user """
+    if args.csv_file is not None:
+        return read_user_list(args.csv_file)
+    if not args.target_user:
+        return []
+    return list(dict.fromkeys(user.strip() for user in args.target_user.split(",") if user.strip()))
+
+def fetch_user_groups(connection: RestSession, user: str) -> list:
+    """ Returns the group IDs of /xapi/users/{user}/groups """
+    return connection.get_json(f"/xapi/users/{user}/groups")
+
+def iterate_user_groups(connection: RestSession, args: argparse.Namespace, writer) -> Iterator[Tuple[str, list]]:
+    """
+    Yields (user, groups) for every target user in input order while --workers requests
+    run concurrently over the one session; a user whose groups cannot be read becomes an ERROR row
+    """
+    fetch_groups = functools.partial(fetch_user_groups, connection)
+    workers = xnat_cli_scripts.cli_common.extract_workers(args)
+    for user, user_groups, error in xnat_cli_scripts.cli_common.ordered_map(fetch_groups, extract_target_users(args), workers):
+        if error is not None:
+            writer.error([user], xnat_cli_scripts.cli_common.format_error(error))
+            continue
+        yield user, user_groups
+
+def execute_list_user_projects(connection: RestSession, args: argparse.Namespace) -> None:
+    columns = ["Index", "Group Count", "User", "Project"] if args.verbose else ["User", "Project"]
+    with xnat_cli_scripts.cli_common.open_row_writer(args, columns) as writer:
+        for target_user, user_groups in iterate_user_groups(connection, args, writer):
+            index = 1
+            group_length = len(user_groups)
+            for x_group in user_groups:
+                role_index = x_group.rindex("_")
+                project_only = x_group[:role_index]
+                if args.verbose:
+                    writer.row(index, group_length, target_user, project_only)
+                    index += 1
+                else:
+                    writer.row(target_user, project_only)
+
+def execute_list_user_groups(connection: RestSession, args: argparse.Namespace) -> None:
+    columns = ["Index", "User", "Group"] if args.verbose else ["User", "Group"]
+    with xnat_cli_scripts.cli_common.open_row_writer(args, columns) as writer:
+        for target_user, user_groups in iterate_user_groups(connection, args, writer):
+            index = 1
+            for x_group in user_groups:
+                if args.verbose:
+                    writer.row(index, target_user, x_group)
+                    index += 1
+                else:
+                    writer.row(target_user, x_group)
+
+def execute_list_master(connection: RestSession, args: argparse.Namespace) -> None:
     if (args.projects):
         execute_list_user_projects(connection, args)
     elif (args.groups):
@@ -66,58 +100,166 @@ def execute_list_master(connection: xnat.session.XNATSession, args: argparse.Nam
         print("Request to list requires --groups or --projects")
 
 
-def remove_user_group(user: str, group: str, sleep_time: float, verbose: bool) -> None:
-    print(f"Remove user from group {user} {group} {sleep_time} {verbose}")
-
-def execute_remove_user_groups(connection: xnat.session.XNATSession, args: argparse.Namespace) -> None:
-    if (args.csv_file is None):
-        target_user = args.target_user
-        user_groups = connection.get_json(f"/xapi/users/{target_user}/groups")
-        for x_group in user_groups:
-            remove_user_group(target_user, x_group, args.sleep, args.verbose)
-
-    else:
-        with open(args.csv_file, newline='') as csvfile:
-            rdr = csv.reader(csvfile, delimiter='\t')
-            for row in rdr:
-                user = row[0]
-                group = row[1]
-                remove_user_group(user, group, args.sleep, args.verbose)
-
-def execute_remove_master(connection: xnat.session.XNATSession, args: argparse.Namespace) -> None:
+def remove_user_group(connection: RestSession, change: Tuple[str, str]) -> str:
+    user, group = change
+    connection.delete(f"/xapi/users/{user}/groups/{group}")
+    return "REMOVED"
+
+def read_user_group_rows(csv_file: str) -> list:
+    """ Returns the (user, group) rows of a {user}{tab}{group} file ('-' reads stdin) """
+    rows = []
+    infile = sys.stdin if csv_file == "-" else open(csv_file, newline='')
+    try:
+        for row in csv.reader(infile, delimiter='\t'):
+            if len(row) < 2 or not row[0].strip() or not row[1].strip():
+                if row:
+                    print(f"[ERROR] Invalid row format: {row}. Skipping.", file=sys.stderr)
+                continue
+            rows.append((row[0].strip(), row[1].strip()))
+    finally:
+        if infile is not sys.stdin:
+            infile.close()
+    return rows
+
+def execute_remove_user_groups(connection: RestSession, args: argparse.Namespace) -> None:
+    """
+    Removes users from groups: the {user}{tab}{group} rows of --csv, or every group of the
+    -t user(s). Rows are grouped per user so each user's current groups are read once;
+    groups the user is not in are reported ABSENT without a request, and the DELETEs run
+    --workers at a time.
+    Output: {user}{tab}{group}{tab}REMOVED|ABSENT|ERROR
+    """
+    workers = xnat_cli_scripts.cli_common.extract_workers(args)
+    fetch_groups = functools.partial(fetch_user_groups, connection)
+
+    results = {}
+    with xnat_cli_scripts.cli_common.open_row_writer(args, ["User", "Group", "Status"]) as writer:
+        if (args.csv_file is None):
+            rows = []
+            for target_user, user_groups, error in xnat_cli_scripts.cli_common.ordered_map(fetch_groups, extract_target_users(args), workers):
+                if error is not None:
+                    writer.error([target_user, ""], xnat_cli_scripts.cli_common.format_error(error))
+                    continue
+                rows.extend((target_user, x_group) for x_group in user_groups)
+            removals = rows
+        else:
+            rows = read_user_group_rows(args.csv_file)
+            users = list(dict.fromkeys(user for user, _ in rows))
+            current = {}
+            for user, user_groups, error in xnat_cli_scripts.cli_common.ordered_map(fetch_groups, users, workers):
+                if error is not None:
+                    results.update({(u, g): ("ERROR", xnat_cli_scripts.cli_common.format_error(error)) for u, g in rows if u == user})
+                else:
+                    current[user] = set(user_groups)
+            for user, group in rows:
+                if user in current and group not in current[user]:
+                    results[(user, group)] = ("ABSENT", None)
+            removals = list(dict.fromkeys(row for row in rows if row not in results))
+
+        remove_group = functools.partial(remove_user_group, connection)
+        for change, status, error in xnat_cli_scripts.cli_common.ordered_map(remove_group, removals, workers):
+            results[change] = ("ERROR", xnat_cli_scripts.cli_common.format_error(error)) if error is not None else (status, None)
+
+        for user, group in rows:
+            status, message = results[(user, group)]
+            if message is not None:
+                writer.error([user, group], message, status)
+            else:
+                writer.row(user, group, status)
+
+def execute_remove_master(connection: RestSession, args: argparse.Namespace) -> None:
     if (args.groups):
         execute_remove_user_groups(connection, args)
     else:
         print("Request to remove groups requires --groups")
 
-def execute_user_group_clone(connection: xnat.session.XNATSession, args: argparse.Namespace) -> None:
+# Status codes meaning the server has no bulk PUT /xapi/users/{user}/groups
+BULK_UNSUPPORTED_STATUS = (404, 405, 415)
+
+def add_user_groups(connection: RestSession, change: Tuple[str, list]) -> str:
+    """ Adds all groups to the user with one PUT of the JSON list """
+    target_user, groups = change
+    connection.put(f"/xapi/users/{target_user}/groups", json=groups)
+    return "ADDED"
+
+def add_user_group(connection: RestSession, change: Tuple[str, str]) -> str:
+    target_user, group = change
+    connection.put(f"/xapi/users/{target_user}/groups/{group}")
+    return "ADDED"
+
+def execute_user_group_clone(connection: RestSession, args: argparse.Namespace) -> None:
+    """
+    Gives every target user (-t, comma separated, or --csv) the groups of the -C source user.
+    Groups a target already has are reported as PRESENT and not written again. The missing
+    groups of a target go in one bulk PUT when the server supports it, otherwise one PUT
+    per group; either way --workers requests run concurrently.
+    Output: {source}{tab}{target}{tab}{group}{tab}ADDED|PRESENT|ERROR
+    """
     source_user = args.clone_groups
-    target_user = args.target_user
-    user_groups = connection.get_json(f"/xapi/users/{source_user}/groups")
-    index = 1
-    group_length = len(user_groups)
-    float_sleep = 0.0
-    if (args.sleep is not None):
-        float_sleep = float(args.sleep)
-
-    for x_group in user_groups:
-        if args.verbose:
-            print(f"{index} {group_length} {source_user} -> {target_user} : {x_group}")
-            index += 1
-
-        connection.put(f"/xapi/users/{target_user}/groups/{x_group}")
-        sleep(float_sleep)
-
-
-
-if __name__ == "__main__":
+    target_users = [user for user in extract_target_users(args) if user != source_user]
+    workers = xnat_cli_scripts.cli_common.extract_workers(args)
+    results = {}
+
+    with xnat_cli_scripts.cli_common.open_row_writer(args, ["Source", "Target", "Group", "Status"]) as writer:
+        try:
+            user_groups = fetch_user_groups(connection, source_user)
+        except Exception as e:
+            writer.error([source_user], xnat_cli_scripts.cli_common.format_error(e))
+            return
+
+        # Diff each target against its current groups
+        missing = {}
+        fetch_groups = functools.partial(fetch_user_groups, connection)
+        for target_user, current_groups, error in xnat_cli_scripts.cli_common.ordered_map(fetch_groups, target_users, workers):
+            if error is not None:
+                for x_group in user_groups:
+                    results[(target_user, x_group)] = ("ERROR", xnat_cli_scripts.cli_common.format_error(error))
+                continue
+            current = set(current_groups)
+            for x_group in user_groups:
+                if x_group in current:
+                    results[(target_user, x_group)] = ("PRESENT", None)
+            missing[target_user] = [x_group for x_group in user_groups if x_group not in current]
+
+        # One bulk request per target; the first answer tells whether the server supports it
+        bulk_changes = [(target_user, groups) for target_user, groups in missing.items() if groups]
+        single_changes = []
+        bulk_supported = True
+        add_groups = functools.partial(add_user_groups, connection)
+        for batch in (bulk_changes[:1], bulk_changes[1:]):
+            if not bulk_supported:
+                single_changes.extend((target_user, x_group) for target_user, groups in batch for x_group in groups)
+                continue
+            for (target_user, groups), status, error in xnat_cli_scripts.cli_common.ordered_map(add_groups, batch, workers):
+                if error is None:
+                    for x_group in groups:
+                        results[(target_user, x_group)] = (status, None)
+                    continue
+                if getattr(error, "status_code", None) in BULK_UNSUPPORTED_STATUS:
+                    bulk_supported = False
+                single_changes.extend((target_user, x_group) for x_group in groups)
+
+        add_group = functools.partial(add_user_group, connection)
+        for change, status, error in xnat_cli_scripts.cli_common.ordered_map(add_group, single_changes, workers):
+            results[change] = ("ERROR", xnat_cli_scripts.cli_common.format_error(error)) if error is not None else (status, None)
+
+        for target_user in target_users:
+            for x_group in user_groups:
+                status, message = results[(target_user, x_group)]
+                if message is not None:
+                    writer.error([source_user, target_user, x_group], message, status)
+                else:
+                    writer.row(source_user, target_user, x_group, status)
+
+
+def main() -> None:
     parser = argparse.ArgumentParser(description="List projects from an XNAT system")
 
     ## XNAT user/login information
     parser.add_argument('-x', '--xnat',            dest='url',             help="URL to XNAT, default is https://cnda.wustl.edu")
     parser.add_argument('-a', '--auth',            dest='auth',            help="User authentication/login for access to XNAT", required=True)
     parser.add_argument('-p', '--password',        dest='password',        help="Password for XNAT authentication", required=False)
-    parser.add_argument('-e', '--extension_types', dest='extension_types', help="True or False for extension_types in xnat.connect")
+    parser.add_argument('-e', '--extension_types', dest='extension_types', help="Ignored; accepted so existing scripts that pass -e True/False still run")
 
     ## These are operations
     parser.add_argument('-L', '--list',            dest='list',            help="Action is to LIST",             action='store_true')
@@ -127,14 +269,16 @@ if __name__ == "__main__":
     # These are objects of the operations; they regulate the action
     parser.add_argument('-P', '--projects',        dest='projects',        help='Verb object: Projects',         action='store_true')
     parser.add_argument('-g', '--groups',          dest='groups',          help='Verb object: Groups',           action='store_true')
-    parser.add_argument('-c', '--csv',             dest='csv_file',        help="CSV file with list of objects (projects, roles, ...) for operations")
-    parser.add_argument('-t', '--target_user',     dest='target_user',     help='Target user: Operations performed on the target')
+    parser.add_argument('-c', '--csv',             dest='csv_file',        help="CSV file with list of objects (users, roles, ...) for operations; '-' reads stdin")
+    parser.add_argument('-t', '--target_user',     dest='target_user',     help='Target user(s), comma separated: Operations performed on the target')
 
     ## Further modifiers
     parser.add_argument('-b', '--brief',           dest='brief_format',    help="List in brief format",          action='store_true')
-    parser.add_argument('-s', '--sleep',           dest='sleep',           help="Time to sleep after each REST call")
+    parser.add_argument('-s', '--sleep',           dest='sleep',           help="Deprecated: same as --rate 1/SLEEP")
     parser.add_argument('-v', '--verbose',         dest='verbose',         help="Verbose mode", action='store_true')
     parser.add_argument('-z', '--zebra',           dest='zebra',           help="Zebra mode for testing/debugging", action='store_true')
+    xnat_cli_scripts.cli_common.add_session_arguments(parser)
+    xnat_cli_scripts.cli_common.add_output_arguments(parser)
 
 #    parser.add_argument('-p', '--project',         dest='project_id',      help="Optional Project ID used in list process")
 #    parser.add_argument('-d', '--delete',          dest='delete_sessions', help="Action is to DELETE sessions",  action='store_true')
@@ -142,13 +286,11 @@ if __name__ == "__main__":
 
     args = parser.parse_args()
 
+    from xnat_cli_scripts import cli_session
+
     args.url = "https://cnda.wustl.edu" if args.url is None else args.url
-   
-    auth_user=xnat_cli_scripts.cli_common.extract_auth_user(args)
-    auth_password=xnat_cli_scripts.cli_common.extract_auth_password(args)
-    xnat_extensions=xnat_cli_scripts.cli_common.extract_extension_types(args)
 
-    connection = xnat.connect(args.url, user=auth_user, password=auth_password, extension_types=xnat_extensions)
+    connection = cli_session.connect(args)
 
     if args.list:
         execute_list_master(connection, args)
@@ -162,3 +304,6 @@ if __name__ == "__main__":
 
     connection.disconnect()
 
+
+if __name__ == "__main__":
+    main()
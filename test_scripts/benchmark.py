@@ -0,0 +1,148 @@
+#!/bin/python3
+"""
+benchmark.py
+---
+--------------------------------------------------------------------------------
+Runs the CLI commands against mock_xnat.py and reports, per scenario, the number
+of requests the mock served, the wall time and the peak RSS of the command.
+The same fixture sizes and latency give comparable numbers from run to run, so
+the table can be kept next to a change as its before/after measurement.
+
+Example usage of the CLI:
+```bash
+$ python3 test_scripts/benchmark.py --projects 500 --latency 0.02
+$ python3 test_scripts/benchmark.py --only projects-groups --workers 1,8
+```
+"""
+
+__version__ = (1, 0, 0)
+
+import argparse
+import base64
+import csv
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import mock_xnat
+
+
+SOURCE_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")
+
+# (scenario name, module, arguments); {auth} and the input files are filled in per run,
+# {workers} expands one scenario into one run per --workers value
+SCENARIOS = [
+    ("projects-list-brief",     "projects", "{auth} -L --brief"),
+    ("projects-list",           "projects", "{auth} -L"),
+    ("projects-list-verbose",   "projects", "{auth} -L --verbose"),
+    ("projects-users",          "projects", "{auth} -L --users -w {workers}"),
+    ("projects-groups",         "projects", "{auth} -L --groups -w {workers}"),
+    ("projects-subjects",       "projects", "{auth} -L --subjects"),
+    ("projects-access",         "projects", "{auth} -L --accessibilities"),
+    ("users-groups",            "users",    "{auth} -L -g -t user00001"),
+    ("users-projects",          "users",    "{auth} -L -P -t user00001"),
+    ("sessions-list",           "sessions", "{session_auth} -l"),
+    ("sessions-rename",         "sessions", "{session_auth} -r -c {rename_csv} -w {workers}"),
+    ("snapshot-create",         "snapshot", "create {auth} -o {snapshot} -w {workers}"),
+    ("sessions-delete",         "sessions", "{session_auth} -d -c {delete_csv} -w {workers} --journal {journal}"),
+]
+
+# The mock rejects unauthenticated REST calls like XNAT does
+MOCK_AUTHORIZATION = "Basic " + base64.b64encode(b"admin:admin").decode("ascii")
+
+COLUMNS = ["Scenario", "Workers", "Exit", "Requests", "Wall (s)", "Peak RSS (MB)", "Output Lines"]
+
+
+def mock_request(base_url: str, path: str, method: str = "GET") -> dict:
+    request = urllib.request.Request(base_url + path, method=method, headers={"Authorization": MOCK_AUTHORIZATION})
+    with urllib.request.urlopen(request) as response:
+        body = response.read()
+    return json.loads(body) if body else {}
+
+
+def write_session_csvs(base_url: str, folder: str, rows: int) -> dict:
+    """ Tab separated inputs for the rename and delete scenarios, drawn from the mock's experiments """
+    listing = mock_request(base_url, "/data/experiments?columns=ID,label,project")
+    experiments = listing["ResultSet"]["Result"][:rows]
+
+    files = {"rename_csv": os.path.join(folder, "rename.csv"),
+             "delete_csv": os.path.join(folder, "delete.csv"),
+             "journal":    os.path.join(folder, "delete.journal"),
+             "snapshot":   os.path.join(folder, "snapshot.sqlite")}
+    with open(files["rename_csv"], 'w', newline='') as outfile:
+        writer = csv.writer(outfile, delimiter='\t')
+        for experiment in experiments:
+            writer.writerow([experiment["project"], experiment["ID"], experiment["label"] + "_R"])
+    with open(files["delete_csv"], 'w', newline='') as outfile:
+        writer = csv.writer(outfile, delimiter='\t')
+        for experiment in experiments:
+            writer.writerow([experiment["project"], experiment["ID"]])
+    return files
+
+
+def run_command(command: list, stdin_text: str, env: dict) -> tuple:
+    """ Returns (exit status, wall seconds, peak RSS in MB, output lines) of one child process """
+    start = time.perf_counter()
+    process = subprocess.Popen(command, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, env=env)
+    process.stdin.write(stdin_text.encode("utf-8"))
+    process.stdin.close()
+    output = process.stdout.read()
+    process.stdout.close()
+    # Reaped with wait4 rather than Popen.wait so the resource usage is that of this child alone
+    _, status, usage = os.wait4(process.pid, 0)
+    process.returncode = exit_code = os.waitstatus_to_exitcode(status)
+    peak_rss = usage.ru_maxrss / 1024.0
+    wall = time.perf_counter() - start
+    return exit_code, wall, peak_rss, output.count(b"\n")
+
+
+def run_scenarios(args) -> None:
+    server = mock_xnat.start_server(args)
+    base_url = f"http://127.0.0.1:{server.server_port}"
+    workers_values = [int(w) for w in args.workers.split(",")]
+
+    env = dict(os.environ)
+    env["PYTHONPATH"] = SOURCE_FOLDER + os.pathsep + env.get("PYTHONPATH", "")
+
+    with tempfile.TemporaryDirectory() as folder:
+        # Cached JSESSION tokens stay inside the run
+        env["XDG_CACHE_HOME"] = folder
+        print("\t".join(COLUMNS))
+        for name, module, arguments in SCENARIOS:
+            if args.only and name not in args.only.split(","):
+                continue
+            for workers in (workers_values if "{workers}" in arguments else [1]):
+                # Every run starts from fresh fixtures and zeroed counters
+                mock_request(base_url, "/mock/reset", method="POST")
+                files = write_session_csvs(base_url, folder, args.session_rows)
+                for previous in (files["journal"], files["snapshot"]):
+                    if os.path.exists(previous):
+                        os.remove(previous)
+
+                text = arguments.format(auth=f"-a admin:admin -x {base_url} -e False",
+                                        session_auth=f"-u admin -x {base_url} -e False",
+                                        workers=workers, **files)
+                command = [sys.executable, "-m", f"xnat_cli_scripts.{module}"] + text.split()
+                requests_before = mock_request(base_url, "/mock/stats").get("requests", 0)
+                exit_code, wall, peak_rss, lines = run_command(command, "admin\n", env)
+                requests = mock_request(base_url, "/mock/stats").get("requests", 0) - requests_before
+                print(f"{name}\t{workers}\t{exit_code}\t{requests}\t{wall:.2f}\t{peak_rss:.1f}\t{lines}", flush=True)
+
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the CLI commands against a local mock XNAT")
+    parser.add_argument('-w', '--workers',         dest='workers',         help="Comma separated worker counts for concurrent scenarios (default 1,8)", default="1,8")
+    parser.add_argument(      '--only',            dest='only',            help="Comma separated scenario names to run")
+    parser.add_argument(      '--session-rows',    dest='session_rows',    help="Sessions in the rename/delete CSV files (default 100)", type=int, default=100)
+    mock_xnat.add_fixture_arguments(parser)
+
+    args = parser.parse_args()
+
+    run_scenarios(args)
@@ -0,0 +1,13 @@
+#!/bin/bash
+
+# Runs benchmark.py against the local mock XNAT at a small and a large archive size.
+# Extra arguments are passed to both runs (for example --latency 0.02 or --only projects-groups).
+
+ BASE_FOLDER=`dirname $0`
+
+ echo "Small archive: 50 projects"
+ python3 $BASE_FOLDER/benchmark.py --projects 50 --users 200 "$@"
+
+ echo ""
+ echo "Large archive: 1000 projects"
+ python3 $BASE_FOLDER/benchmark.py --projects 1000 --users 5000 --members 20 "$@"
@@ -0,0 +1,90 @@
+#!/bin/bash
+
+# Compares the default header-only extraction of dicom_metadata.py with a full
+# dcmread of every file (--full).
+# Without a directory argument, a synthetic multi-frame Enhanced MR file
+# (512 frames of 512x512x16 bit, about 256 MB) is generated in /tmp first.
+
+# Arguments:
+#              Base Folder
+#              Output file
+generate_multiframe() {
+ export PYTHONPATH="$1/../src"
+
+ python3 - "$2" <<'EOF'
+import sys
+import pydicom
+from pydicom.dataset import Dataset, FileMetaDataset
+from pydicom.uid import ExplicitVRLittleEndian, generate_uid
+
+frames, rows, columns = 512, 512, 512
+meta = FileMetaDataset()
+meta.MediaStorageSOPClassUID = "1.2.840.10008.5.1.4.1.1.4.1"
+meta.MediaStorageSOPInstanceUID = generate_uid()
+meta.TransferSyntaxUID = ExplicitVRLittleEndian
+
+ds = Dataset()
+ds.file_meta = meta
+ds.SOPClassUID = meta.MediaStorageSOPClassUID
+ds.SOPInstanceUID = meta.MediaStorageSOPInstanceUID
+ds.StudyDate = "20240101"
+ds.StudyTime = "120000"
+ds.StationName = "BENCH"
+ds.PatientName = "Benchmark^Multiframe"
+ds.PatientID = "BENCH001"
+ds.StudyInstanceUID = generate_uid()
+ds.NumberOfFrames = frames
+ds.Rows = rows
+ds.Columns = columns
+ds.SamplesPerPixel = 1
+ds.PhotometricInterpretation = "MONOCHROME2"
+ds.BitsAllocated = 16
+ds.BitsStored = 16
+ds.HighBit = 15
+ds.PixelRepresentation = 0
+ds.PixelData = bytes(frames * rows * columns * 2)
+ds.save_as(sys.argv[1], enforce_file_format=True)
+EOF
+}
+
+# Drops the page cache so the next run reads from disk; only root may do this
+drop_page_cache() {
+ sync
+ if [ -w /proc/sys/vm/drop_caches ] ; then
+  echo 3 > /proc/sys/vm/drop_caches
+ else
+  echo "WARNING: /proc/sys/vm/drop_caches is not writable; the next run may read from the page cache"
+ fi
+}
+
+# Arguments:
+#              Base Folder
+#              Directory of DICOM files
+#              Extra options
+time_extract() {
+ export PYTHONPATH="$1/../src"
+
+ echo python3 -m xnat_cli_scripts.dicom_metadata -e -d "$2" $3
+ time python3 -m xnat_cli_scripts.dicom_metadata -e -d "$2" $3 > /dev/null
+}
+
+
+ BASE_FOLDER=`dirname $0`
+
+ if [ $# -ge 1 ] ; then
+  DICOM_FOLDER="$1"
+ else
+  DICOM_FOLDER=/tmp/dicom_header_benchmark
+  mkdir -p $DICOM_FOLDER
+  if [ ! -f $DICOM_FOLDER/multiframe.dcm ] ; then
+   generate_multiframe "$BASE_FOLDER" $DICOM_FOLDER/multiframe.dcm
+  fi
+ fi
+ ls -l $DICOM_FOLDER | head
+
+ # Drop the page cache first when possible so both runs read from disk
+ drop_page_cache
+ time_extract "$BASE_FOLDER" "$DICOM_FOLDER" "--full -w 1"
+
+ drop_page_cache
+ time_extract "$BASE_FOLDER" "$DICOM_FOLDER" "-w 1"
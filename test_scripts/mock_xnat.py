@@ -0,0 +1,450 @@
+#!/bin/python3
+"""
+mock_xnat.py
+---
+--------------------------------------------------------------------------------
+A local stand-in for the parts of the XNAT REST API used by xnat_cli_scripts.
+Projects, memberships, user groups, subjects, experiments and scans are generated
+from a seed at a configurable size, so commands can be measured without touching
+a real archive. Every request is counted per endpoint; GET /mock/stats returns the
+counts and POST /mock/reset clears them and regenerates the fixtures.
+
+Example usage of the CLI:
+```bash
+$ python3 test_scripts/mock_xnat.py --port 8080 --projects 500 --latency 0.02
+$ python3 -m xnat_cli_scripts.projects -a admin:admin -x http://localhost:8080 -e False -L --groups
+```
+"""
+
+__version__ = (1, 0, 0)
+
+import argparse
+import collections
+import hashlib
+import http.cookies
+import http.server
+import json
+import random
+import re
+import secrets
+import threading
+import time
+import urllib.parse
+
+
+XNAT_VERSION = "1.8.10"
+GROUP_ROLES = ["owner", "member", "collaborator"]
+ACCESSIBILITIES = ["private", "protected", "public"]
+MODALITIES = ["MR", "CT", "PET"]
+SCAN_ID_COLUMN = "xnat:imagescandata/id"
+
+# Just enough of the xdat/xnat schemas for xnatpy to build its (empty) object model
+MINIMAL_SCHEMA = """<?xml version="1.0" encoding="UTF-8"?>
+<xs:schema targetNamespace="http://nrg.wustl.edu/{name}" xmlns:{name}="http://nrg.wustl.edu/{name}"
+           xmlns:xs="http://www.w3.org/2001/XMLSchema" elementFormDefault="qualified" attributeFormDefault="unqualified">
+</xs:schema>
+"""
+
+
+class MockArchive:
+    """ Synthetic archive contents; all collections are plain dicts keyed by ID """
+
+    def __init__(self, args: argparse.Namespace):
+        self.args = args
+        self.lock = threading.Lock()
+        self.generate()
+
+    def generate(self) -> None:
+        rng = random.Random(self.args.seed)
+        self.users = [f"user{i:05d}" for i in range(1, self.args.users + 1)]
+        self.projects = collections.OrderedDict()
+        self.memberships = {}     # project -> {login: role}
+        self.subjects = collections.OrderedDict()
+        self.experiments = collections.OrderedDict()
+
+        experiment_number = 1
+        for p in range(1, self.args.projects + 1):
+            project_id = f"PRJ{p:05d}"
+            self.projects[project_id] = {
+                "ID":             project_id,
+                "secondary_ID":   project_id,
+                "name":           f"Project {p}",
+                "description":    "",
+                "pi_firstname":   "" if p % 5 == 0 else "Pat",
+                "pi_lastname":    "" if p % 5 == 0 else f"Investigator{p % 17}",
+                "URI":            f"/data/projects/{project_id}",
+                "project_access": ACCESSIBILITIES[p % len(ACCESSIBILITIES)],
+            }
+            members = rng.sample(self.users, min(self.args.members, len(self.users)))
+            self.memberships[project_id] = {login: GROUP_ROLES[i % len(GROUP_ROLES)] for i, login in enumerate(members)}
+
+            for s in range(1, self.args.subjects + 1):
+                subject_id = f"{project_id}_S{s:05d}"
+                self.subjects[subject_id] = {
+                    "ID":          subject_id,
+                    "label":       f"SUBJ{s:05d}",
+                    "project":     project_id,
+                    "insert_date": "2024-01-01 12:00:00.0",
+                    "URI":         f"/data/subjects/{subject_id}",
+                }
+                for e in range(1, self.args.experiments + 1):
+                    experiment_id = f"XNAT_E{experiment_number:08d}"
+                    experiment_number += 1
+                    self.experiments[experiment_id] = {
+                        "ID":          experiment_id,
+                        "label":       f"SUBJ{s:05d}_MR{e}",
+                        "project":     project_id,
+                        "subject_ID":  subject_id,
+                        "insert_date": "2024-01-01 12:00:00.0",
+                        "date":        "2024-01-01",
+                        "modality":    MODALITIES[e % len(MODALITIES)],
+                        "xsiType":     "xnat:mrSessionData",
+                        "scans":       self.args.scans,
+                        "URI":         f"/data/experiments/{experiment_id}",
+                    }
+
+    def user_groups(self, login: str) -> list:
+        return [f"{project_id}_{roles[login]}" for project_id, roles in self.memberships.items() if login in roles]
+
+
+class MockXNATHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    archive = None
+    stats = collections.Counter()
+    stats_lock = threading.Lock()
+    throttle = None
+    sessions = set()
+
+    # Handlers answered without a JSESSIONID cookie or basic auth
+    PUBLIC_HANDLERS = ("root", "login", "logout", "mock_stats", "mock_reset")
+
+    # (method, regex, handler name); the regex names the endpoint template in /mock/stats
+    ROUTES = [
+        ("GET",    r"/data/projects",                                    "list_projects"),
+        ("GET",    r"/data/projects/(?P<project>[^/]+)/users",           "list_project_users"),
+        ("PUT",    r"/data/projects/(?P<project>[^/]+)/users/(?P<group>[^/]+)/(?P<login>[^/]+)", "put_project_user"),
+        ("DELETE", r"/data/projects/(?P<project>[^/]+)/users/(?P<group>[^/]+)/(?P<login>[^/]+)", "delete_project_user"),
+        ("GET",    r"/data/projects/(?P<project>[^/]+)/accessibility",   "get_accessibility"),
+        ("PUT",    r"/data/projects/(?P<project>[^/]+)/accessibility/(?P<accessibility>[^/]+)", "put_accessibility"),
+        ("GET",    r"/data/projects/(?P<project>[^/]+)/subjects",        "list_subjects"),
+        ("GET",    r"/data/projects/(?P<project>[^/]+)/experiments",     "list_experiments"),
+        ("DELETE", r"/data/projects/(?P<project>[^/]+)/experiments/(?P<experiment>[^/]+)", "delete_experiment"),
+        ("PUT",    r"/(?:REST|data)/projects/(?P<project>[^/]+)/subjects/(?P<subject>[^/]+)/experiments/(?P<experiment>[^/]+)", "put_experiment"),
+        ("GET",    r"/data/subjects",                                    "list_subjects"),
+        ("GET",    r"/data/experiments",                                 "list_experiments"),
+        ("GET",    r"/xapi/users/(?P<login>[^/]+)/groups",               "list_user_groups"),
+        ("PUT",    r"/xapi/users/(?P<login>[^/]+)/groups",               "put_user_groups"),
+        ("PUT",    r"/xapi/users/(?P<login>[^/]+)/groups/(?P<group>[^/]+)", "put_user_group"),
+        ("DELETE", r"/xapi/users/(?P<login>[^/]+)/groups/(?P<group>[^/]+)", "delete_user_group"),
+        ("GET",    r"/data/search/elements",                             "search_elements"),
+        ("GET",    r"/xapi/schemas",                                     "list_schemas"),
+        ("GET",    r"/xapi/schemas/(?P<schema>[^/]+)",                   "get_schema"),
+        ("GET",    r"/xapi/siteConfig/buildInfo",                        "build_info"),
+        ("GET",    r"/data/version",                                     "version"),
+        ("GET",    r"/data/auth",                                        "auth"),
+        ("PUT",    r"/data/services/auth",                               "login"),
+        ("GET",    r"/data/JSESSION",                                    "login"),
+        ("POST",   r"/data/JSESSION",                                    "login"),
+        ("DELETE", r"/data/JSESSION",                                    "logout"),
+        ("GET",    r"/mock/stats",                                       "mock_stats"),
+        ("POST",   r"/mock/reset",                                       "mock_reset"),
+        ("GET",    r"/",                                                 "root"),
+    ]
+    COMPILED_ROUTES = [(method, re.compile(pattern.rstrip("/") + "/?$"), re.sub(r"\(\?P<(\w+)>[^)]*\)", r"{\1}", pattern), name)
+                       for method, pattern, name in ROUTES]
+
+    def log_message(self, format, *args) -> None:
+        pass
+
+    def do_GET(self) -> None:
+        self.dispatch("GET")
+
+    def do_PUT(self) -> None:
+        self.dispatch("PUT")
+
+    def do_POST(self) -> None:
+        self.dispatch("POST")
+
+    def do_DELETE(self) -> None:
+        self.dispatch("DELETE")
+
+    def dispatch(self, method: str) -> None:
+        url = urllib.parse.urlsplit(self.path)
+        self.query = dict(urllib.parse.parse_qsl(url.query))
+        length = int(self.headers.get("Content-Length") or 0)
+        self.body = self.rfile.read(length) if length else b""
+
+        for route_method, pattern, template, name in self.COMPILED_ROUTES:
+            match = pattern.match(url.path)
+            if route_method == method and match:
+                break
+        else:
+            self.respond(404, "text/plain", b"Not found")
+            return
+
+        if not template.startswith("/mock/"):
+            with self.stats_lock:
+                self.stats[f"{method} {template}"] += 1
+                self.stats["requests"] += 1
+            if self.throttle is not None and not self.throttle.allow():
+                self.respond(429, "text/plain", b"Too many requests", {"Retry-After": "1"})
+                return
+            if self.server.latency > 0:
+                time.sleep(self.server.latency)
+
+        if name not in self.PUBLIC_HANDLERS and not self.authorized():
+            self.respond_text("Unauthorized", 401)
+            return
+
+        getattr(self, "handle_" + name)(**match.groupdict())
+
+    def authorized(self) -> bool:
+        if (self.headers.get("Authorization") or "").startswith("Basic "):
+            return True
+        cookies = http.cookies.SimpleCookie(self.headers.get("Cookie") or "")
+        return "JSESSIONID" in cookies and cookies["JSESSIONID"].value in self.sessions
+
+    def respond(self, status: int, content_type: str, body: bytes, headers: dict = None) -> None:
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def respond_json(self, document) -> None:
+        body = json.dumps(document).encode("utf-8")
+        etag = '"' + hashlib.md5(body).hexdigest() + '"'
+        if self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        self.respond(200, "application/json", body, {"ETag": etag})
+
+    def respond_result_set(self, rows: list) -> None:
+        columns = self.query.get("columns")
+        if columns:
+            names = columns.split(",")
+            rows = [{name: row.get(name, "") for name in names} for row in rows]
+        self.respond_json({"ResultSet": {"Result": rows, "totalRecords": str(len(rows))}})
+
+    def respond_text(self, text: str, status: int = 200) -> None:
+        self.respond(status, "text/plain", text.encode("utf-8"))
+
+    # Session handshake used by xnat.connect
+
+    def handle_root(self) -> None:
+        self.respond(200, "text/html", b"<html><body>Mock XNAT</body></html>")
+
+    def handle_auth(self) -> None:
+        self.respond_text("User 'admin' is logged in")
+
+    def handle_login(self) -> None:
+        jsession = secrets.token_hex(16).upper()
+        self.sessions.add(jsession)
+        self.respond(200, "text/plain", jsession.encode("utf-8"), {"Set-Cookie": f"JSESSIONID={jsession}; Path=/"})
+
+    def handle_logout(self) -> None:
+        cookies = http.cookies.SimpleCookie(self.headers.get("Cookie") or "")
+        if "JSESSIONID" in cookies:
+            self.sessions.discard(cookies["JSESSIONID"].value)
+        self.respond_text("")
+
+    def handle_version(self) -> None:
+        self.respond_text(XNAT_VERSION)
+
+    def handle_build_info(self) -> None:
+        self.respond_json({"version": XNAT_VERSION})
+
+    def handle_list_schemas(self) -> None:
+        self.respond_json(["xdat", "xnat"])
+
+    def handle_get_schema(self, schema: str) -> None:
+        self.respond(200, "application/xml", MINIMAL_SCHEMA.format(name=schema.replace(".xsd", "")).encode("utf-8"))
+
+    def handle_search_elements(self) -> None:
+        self.respond_result_set([])
+
+    # Archive endpoints
+
+    def handle_list_projects(self) -> None:
+        self.respond_result_set(list(self.archive.projects.values()))
+
+    def handle_list_project_users(self, project: str) -> None:
+        if project not in self.archive.projects:
+            self.respond_text("Unknown project", 404)
+            return
+        rows = [{"login": login, "GROUP_ID": f"{project}_{role}", "displayname": role.capitalize() + "s"}
+                for login, role in self.archive.memberships[project].items()]
+        self.respond_result_set(rows)
+
+    def handle_put_project_user(self, project: str, group: str, login: str) -> None:
+        if project not in self.archive.projects:
+            self.respond_text("Unknown project", 404)
+            return
+        with self.archive.lock:
+            self.archive.memberships.setdefault(project, {})[login] = group.split("_")[-1].lower()
+        self.respond_text("")
+
+    def handle_delete_project_user(self, project: str, group: str, login: str) -> None:
+        if project not in self.archive.projects:
+            self.respond_text("Unknown project", 404)
+            return
+        with self.archive.lock:
+            self.archive.memberships.get(project, {}).pop(login, None)
+        self.respond_text("")
+
+    def handle_get_accessibility(self, project: str) -> None:
+        if project not in self.archive.projects:
+            self.respond_text("Unknown project", 404)
+            return
+        self.respond_text(self.archive.projects[project]["project_access"])
+
+    def handle_put_accessibility(self, project: str, accessibility: str) -> None:
+        if project not in self.archive.projects:
+            self.respond_text("Unknown project", 404)
+            return
+        with self.archive.lock:
+            self.archive.projects[project]["project_access"] = accessibility
+        self.respond_text("")
+
+    def handle_list_subjects(self, project: str = None) -> None:
+        project = project or self.query.get("project")
+        self.respond_result_set([s for s in self.archive.subjects.values() if project is None or s["project"] == project])
+
+    def handle_list_experiments(self, project: str = None) -> None:
+        project = project or self.query.get("project")
+        experiments = [e for e in self.archive.experiments.values() if project is None or e["project"] == project]
+        if SCAN_ID_COLUMN in self.query.get("columns", "").split(","):
+            # A scan column joins the scans in like XNAT does: one row per scan, one empty row without scans
+            experiments = [dict(e, **{SCAN_ID_COLUMN: str(scan) if e["scans"] else ""})
+                           for e in experiments for scan in range(1, max(e["scans"], 1) + 1)]
+        self.respond_result_set(experiments)
+
+    def handle_delete_experiment(self, project: str, experiment: str) -> None:
+        with self.archive.lock:
+            experiment_json = self.archive.experiments.get(experiment)
+            if experiment_json is None or experiment_json["project"] != project:
+                self.respond_text("Unknown experiment", 404)
+                return
+            del self.archive.experiments[experiment]
+        self.respond_text("")
+
+    def handle_put_experiment(self, project: str, subject: str, experiment: str) -> None:
+        with self.archive.lock:
+            if experiment not in self.archive.experiments:
+                self.respond_text("Unknown experiment", 404)
+                return
+            if "label" in self.query:
+                self.archive.experiments[experiment]["label"] = self.query["label"]
+        self.respond_text("")
+
+    def handle_list_user_groups(self, login: str) -> None:
+        self.respond_json(self.archive.user_groups(login))
+
+    def handle_put_user_groups(self, login: str) -> None:
+        if self.server.no_bulk_groups:
+            self.respond_text("Method not allowed", 405)
+            return
+        for group in json.loads(self.body or b"[]"):
+            project, _, role = group.rpartition("_")
+            with self.archive.lock:
+                self.archive.memberships.setdefault(project, {})[login] = role
+        self.respond_text("")
+
+    def handle_put_user_group(self, login: str, group: str) -> None:
+        project, _, role = group.rpartition("_")
+        with self.archive.lock:
+            self.archive.memberships.setdefault(project, {})[login] = role
+        self.respond_text("")
+
+    def handle_delete_user_group(self, login: str, group: str) -> None:
+        project, _, role = group.rpartition("_")
+        with self.archive.lock:
+            if self.archive.memberships.get(project, {}).get(login) == role:
+                del self.archive.memberships[project][login]
+        self.respond_text("")
+
+    # Control endpoints
+
+    def handle_mock_stats(self) -> None:
+        with self.stats_lock:
+            self.respond(200, "application/json", json.dumps(dict(self.stats)).encode("utf-8"))
+
+    def handle_mock_reset(self) -> None:
+        """ Like a server restart: counters, fixtures and JSESSIONs are all new """
+        with self.stats_lock:
+            self.stats.clear()
+            self.sessions.clear()
+        with self.archive.lock:
+            self.archive.generate()
+        self.respond_text("")
+
+
+class Throttle:
+    """ Server side requests-per-second cap; requests over it get 429 with Retry-After """
+
+    def __init__(self, rate: float):
+        self.rate = rate
+        self.allowance = rate
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def allow(self) -> bool:
+        with self.lock:
+            now = time.monotonic()
+            self.allowance = min(self.rate, self.allowance + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.allowance < 1.0:
+                return False
+            self.allowance -= 1.0
+            return True
+
+
+def add_fixture_arguments(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument(      '--projects',        dest='projects',        help="Number of projects (default 100)",               type=int, default=100)
+    parser.add_argument(      '--users',           dest='users',           help="Number of user accounts (default 500)",          type=int, default=500)
+    parser.add_argument(      '--members',         dest='members',         help="Members per project (default 10)",               type=int, default=10)
+    parser.add_argument(      '--subjects',        dest='subjects',        help="Subjects per project (default 10)",              type=int, default=10)
+    parser.add_argument(      '--experiments',     dest='experiments',     help="Experiments per subject (default 2)",            type=int, default=2)
+    parser.add_argument(      '--scans',           dest='scans',           help="Scans per experiment (default 4)",               type=int, default=4)
+    parser.add_argument(      '--latency',         dest='latency',         help="Seconds added to every request (default 0)",     type=float, default=0.0)
+    parser.add_argument(      '--max-rps',         dest='max_rps',         help="Answer 429 above this many requests per second", type=float)
+    parser.add_argument(      '--no-bulk-groups',  dest='no_bulk_groups',  help="Answer 405 to the bulk PUT /xapi/users/{u}/groups", action='store_true')
+    parser.add_argument(      '--seed',            dest='seed',            help="Seed for the synthetic fixtures (default 1)",    type=int, default=1)
+
+
+def start_server(args: argparse.Namespace, port: int = 0) -> http.server.ThreadingHTTPServer:
+    """ Starts the mock on a daemon thread; port 0 picks a free port (see server.server_port) """
+    handler = type("BoundMockXNATHandler", (MockXNATHandler,), {
+        "archive":  MockArchive(args),
+        "stats":    collections.Counter(),
+        "throttle": Throttle(args.max_rps) if args.max_rps else None,
+        "sessions": set(),
+    })
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", port), handler)
+    server.daemon_threads = True
+    server.latency = args.latency
+    server.no_bulk_groups = args.no_bulk_groups
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve a synthetic XNAT archive for tests and benchmarks")
+    parser.add_argument('-p', '--port',            dest='port',            help="Port to listen on (default 8080)", type=int, default=8080)
+    add_fixture_arguments(parser)
+
+    args = parser.parse_args()
+
+    server = start_server(args, args.port)
+    print(f"Mock XNAT listening on http://127.0.0.1:{server.server_port}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
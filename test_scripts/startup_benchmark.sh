@@ -0,0 +1,48 @@
+#!/bin/bash
+
+# Measures the startup cost of every entry point: wall time of --help (repeated)
+# and, from -X importtime, the total import time and the heaviest top-level imports.
+# --help must not import xnat, requests or pydicom.
+
+# Arguments:
+#              Base Folder
+#              Module name
+#              Repetitions
+time_help() {
+ export PYTHONPATH="$1/../src"
+
+ start=$(date +%s%N)
+ for i in $(seq $3) ; do
+  python3 -m xnat_cli_scripts.$2 --help > /dev/null
+ done
+ end=$(date +%s%N)
+ echo "$2 --help: $(( (end - start) / 1000000 / $3 )) ms per run"
+}
+
+# Arguments:
+#              Base Folder
+#              Module name
+import_profile() {
+ export PYTHONPATH="$1/../src"
+
+ python3 -X importtime -m xnat_cli_scripts.$2 --help 2>&1 > /dev/null \
+  | awk -F'|' '/^import time:/ && $3 !~ /^   / { total += $2; print $2 "\t" $3 } END { print total "\ttotal (us, top-level cumulative)" }' \
+  | sort -n | tail -6
+
+ if python3 -X importtime -m xnat_cli_scripts.$2 --help 2>&1 > /dev/null | grep -E '\| (xnat|requests|pydicom)$' > /dev/null ; then
+  echo "WARNING: $2 --help imports xnat, requests or pydicom"
+ fi
+}
+
+
+ BASE_FOLDER=`dirname $0`
+ REPETITIONS=${1:-5}
+
+ s=$(date +%s%N) ; for i in $(seq $REPETITIONS) ; do python3 -c pass ; done ; e=$(date +%s%N)
+ echo "python3 -c pass: $(( (e - s) / 1000000 / $REPETITIONS )) ms per run"
+
+ for module in projects users sessions snapshot dicom_metadata ; do
+  echo ""
+  time_help "$BASE_FOLDER" $module $REPETITIONS
+  import_profile "$BASE_FOLDER" $module
+ done